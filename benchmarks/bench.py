@@ -0,0 +1,242 @@
+"""
+Times `get_reviewers` and each of its stages against a generated repository.  Every
+measurement runs in a freshly spawned process so its peak RSS is its own, and records the wall
+time, the number of git subprocesses started and the peak RSS of the Python process.  The
+results are written as JSON and can be compared against a stored baseline:
+
+    python -m benchmarks.bench --output baseline.json
+    python -m benchmarks.bench --baseline baseline.json
+"""
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import synthetic
+from git_reviewers import commands, reviewers
+from git_reviewers.cache import CACHE_DIR
+from git_reviewers.commands import run_sync
+import python_lib.shell as shl
+
+
+STAGES = ("raw_diff", "chunking", "blame", "aggregation", "full", "full_warm", "full_replay")
+TOLERANCE = 0.1
+
+
+def read_raw_diff(branch, state):
+    async def read():
+        return [diff_info async for diff_info in
+                reviewers.read_diff_stream(reviewers.stream_diff(branch, patch=False), patch=False)]
+    return run_sync(read())
+
+
+def read_chunks(branch, state):
+    async def read():
+        return [diff_info async for diff_info in reviewers.read_diff_stream(reviewers.stream_diff(branch))]
+    return run_sync(read())
+
+
+def blame(branch, diff_infos):
+    async def unrestored():
+        for diff_info in diff_infos:
+            yield diff_info, False
+
+    async def read():
+        return [diff_info async for diff_info in reviewers.get_files_reviewers(unrestored(), branch, False)]
+    return run_sync(read())
+
+
+def aggregate(branch, diff_infos):
+    return reviewers.get_total_reviewers(diff_infos, synthetic.USER)
+
+
+def get_reviewers(branch, state, use_cache=False):
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        try:
+            reviewers.get_reviewers(None, synthetic.BASE_BRANCH, None, "default", use_cache=use_cache)
+        except SystemExit:
+            pass
+    return output.getvalue()
+
+
+def get_reviewers_warm(branch, state):
+    return get_reviewers(branch, state, use_cache=True)
+
+
+def record(branch, state):
+    """Records the git commands of a run, so it can be replayed without git"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "commands.json")
+        previous = commands.set_backend(commands.RecordingBackend(path))
+        try:
+            get_reviewers(branch, state)
+        finally:
+            commands.get_backend().close()
+            commands.set_backend(previous)
+        return commands.ReplayBackend(path)
+
+
+def replay(branch, backend):
+    commands.set_backend(backend)
+    return get_reviewers(branch, None)
+
+
+# Each stage is timed after running the stages it needs, untimed, for its input
+STAGE_STEPS = dict(
+    raw_diff=(read_raw_diff,),
+    chunking=(read_chunks,),
+    blame=(read_chunks, blame),
+    aggregation=(read_chunks, blame, aggregate),
+    full=(get_reviewers,),
+    full_warm=(get_reviewers_warm, get_reviewers_warm),
+    full_replay=(record, replay),
+)
+
+
+def count_subprocesses(counts):
+    """Counts the git processes started, every command goes through asyncio's subprocess_exec"""
+    create_subprocess_exec = asyncio.create_subprocess_exec
+
+    async def counting_subprocess_exec(*args, **kwargs):
+        counts["subprocesses"] += 1
+        return await create_subprocess_exec(*args, **kwargs)
+
+    asyncio.create_subprocess_exec = counting_subprocess_exec
+
+
+def get_peak_rss_kb():
+    """
+    The peak RSS of this process.  ru_maxrss on Linux keeps the peak of the process it was
+    forked from across exec, so the high water mark of the process's own memory is read instead
+    where there is one.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(path, stage):
+    """Runs the stage in the repository, this is called in its own process"""
+    os.chdir(path)
+    shutil.rmtree(os.path.join(path, ".git", CACHE_DIR), ignore_errors=True)
+
+    branch = run_sync(reviewers.get_commit(synthetic.BASE_BRANCH))
+    run_sync(reviewers.get_toplevel())
+    steps = STAGE_STEPS[stage]
+    state = None
+    for step in steps[:-1]:
+        state = step(branch, state)
+
+    counts = dict(subprocesses=0)
+    count_subprocesses(counts)
+    start = time.perf_counter()
+    steps[-1](branch, state)
+    wall = time.perf_counter() - start
+
+    return dict(wall=wall, subprocesses=counts["subprocesses"], peak_rss_kb=get_peak_rss_kb())
+
+
+def run_stage(path, stage, repeat):
+    runs = []
+    for _ in range(repeat):
+        # Spawned rather than forked, so the process starts without the memory of this one
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            runs.append(executor.submit(measure, path, stage).result())
+
+    walls = sorted(run["wall"] for run in runs)
+    return dict(wall=walls[0], median_wall=walls[len(walls) // 2], walls=[run["wall"] for run in runs],
+                subprocesses=runs[-1]["subprocesses"], peak_rss_kb=max(run["peak_rss_kb"] for run in runs))
+
+
+def run_benchmarks(path, options, stages, repeat):
+    results = dict(options=options, repeat=repeat, python=platform.python_version(),
+                   git=subprocess.check_output(["git", "--version"]).decode("utf-8").strip(), stages={})
+    for stage in stages:
+        results["stages"][stage] = run_stage(path, stage, repeat)
+        print_stage(stage, results["stages"][stage])
+    return results
+
+
+def print_stage(stage, result):
+    shl.stderr("{stage: >12}  {wall: >9.4f}s  {subprocesses: >6} git  {rss: >8} KB",
+               stage=stage, wall=result["wall"], subprocesses=result["subprocesses"], rss=result["peak_rss_kb"])
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Prints each stage's time against the baseline and returns the stages that got slower"""
+    if results["options"] != baseline["options"]:
+        shl.warning("The baseline was run with different options: {options}", options=baseline["options"])
+
+    shl.print_section(shl.BOLD, "Against Baseline:")
+    regressions = []
+    for stage, result in results["stages"].items():
+        base = baseline["stages"].get(stage)
+        if not base:
+            continue
+
+        ratio = result["wall"] / base["wall"] if base["wall"] else 1.0
+        color = shl.RED if ratio > 1 + tolerance else shl.GREEN if ratio < 1 - tolerance else ""
+        shl.stderr(color + "{stage: >12}  {wall: >9.4f}s  was {base: >9.4f}s  x{ratio:.2f}  "
+                   "git {subprocesses} was {base_subprocesses}" + shl.ENDC,
+                   stage=stage, wall=result["wall"], base=base["wall"], ratio=ratio,
+                   subprocesses=result["subprocesses"], base_subprocesses=base["subprocesses"])
+        if ratio > 1 + tolerance:
+            regressions.append(stage)
+
+    return regressions
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Benchmark git reviewers against a generated repository')
+    parser.add_argument('--repo', help="Benchmark an existing repository, at its checked out work tree against "
+                        "master, rather than a generated one.  Its blame cache is cleared")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES), help="The stages to time")
+    parser.add_argument('--repeat', type=int, default=3, help="Times to run each stage, the fastest is kept")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--baseline', help="Compare the results against this JSON file")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help="Fraction a stage may slow down before it counts as a regression")
+    synthetic.add_options(parser)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.abspath(args.repo or os.path.join(tmp, "repo"))
+        if args.repo:
+            options = dict(repo=path)
+        else:
+            options = synthetic.generate(path, **synthetic.get_options(args))
+
+        shl.print_section(shl.BOLD, "Benchmarks:")
+        results = run_benchmarks(path, options, args.stages, args.repeat)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+    else:
+        shl.write_json((results,), end="\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            if compare(results, json.load(f), args.tolerance):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,137 @@
+"""
+Generates deterministic git repositories to benchmark against.  The history is written with
+`git fast-import` from a seeded random generator, so the same options always give the same
+commits, and the working tree is left on a `feature` branch that changes hunks of files
+authored on `master`.
+"""
+import argparse
+import os
+import random
+import subprocess
+
+import python_lib.shell as shl
+
+
+BASE_BRANCH = "master"
+HEAD_BRANCH = "feature"
+START_TIME = 1500000000
+USER = "Benchmark Runner"
+
+DEFAULTS = dict(files=200, lines=200, commits=100, authors=20, touched=10, changed=0.5, hunks=8, seed=0)
+
+
+class SyntheticRepo(object):
+    """The files of a generated repository, edited commit by commit as the history is written out"""
+    def __init__(self, files=200, lines=200, commits=100, authors=20, touched=10, changed=0.5, hunks=8, seed=0):
+        self.options = dict(files=files, lines=lines, commits=commits, authors=authors, touched=touched,
+                            changed=changed, hunks=hunks, seed=seed)
+        self.rng = random.Random(seed)
+        self.authors = [("Author {idx}".format(idx=idx), "author{idx}@example.com".format(idx=idx))
+                        for idx in range(authors)]
+        self.paths = ["dir{dir}/file{idx}.py".format(dir=idx % max(1, files // 20), idx=idx) for idx in range(files)]
+        self.contents = {}
+        self.num_commits = 0
+
+    def commit(self, branch, author, message, edits):
+        """Writes a fast-import commit of the files in edits, marked with its commit number"""
+        self.num_commits += 1
+        name, email = author
+        when = "{time} +0000".format(time=START_TIME + self.num_commits * 3600)
+        message = message.encode("utf-8")
+        output = [
+            "commit refs/heads/{branch}\n".format(branch=branch).encode("utf-8"),
+            "mark :{mark}\n".format(mark=self.num_commits).encode("utf-8"),
+            "author {name} <{email}> {when}\n".format(name=name, email=email, when=when).encode("utf-8"),
+            "committer {name} <{email}> {when}\n".format(name=name, email=email, when=when).encode("utf-8"),
+            "data {size}\n".format(size=len(message)).encode("utf-8"), message, b"\n",
+        ]
+        if self.num_commits > 1:
+            output.append("from :{mark}\n".format(mark=self.num_commits - 1).encode("utf-8"))
+
+        for path in edits:
+            data = "".join(line + "\n" for line in self.contents[path]).encode("utf-8")
+            output.append("M 100644 inline {path}\n".format(path=path).encode("utf-8"))
+            output.append("data {size}\n".format(size=len(data)).encode("utf-8"))
+            output += [data, b"\n"]
+
+        return b"".join(output)
+
+    def rewrite(self, path, start, count):
+        lines = self.contents[path]
+        for line_num in range(start, min(start + count, len(lines))):
+            lines[line_num] = "value_{line} = {commit}  # {token:08x}".format(
+                line=line_num, commit=self.num_commits + 1, token=self.rng.getrandbits(32))
+
+    def history(self):
+        """Yields the fast-import stream of the base history and then the feature branch"""
+        options = self.options
+        for path in self.paths:
+            self.contents[path] = [None] * options["lines"]
+            self.rewrite(path, 0, options["lines"])
+        yield self.commit(BASE_BRANCH, self.rng.choice(self.authors), "Initial commit", self.paths)
+
+        for idx in range(1, options["commits"]):
+            edits = self.rng.sample(self.paths, min(options["touched"], len(self.paths)))
+            for path in edits:
+                count = self.rng.randint(1, max(1, options["lines"] // 4))
+                self.rewrite(path, self.rng.randrange(options["lines"]), count)
+            yield self.commit(BASE_BRANCH, self.rng.choice(self.authors), "Commit {idx}".format(idx=idx), edits)
+
+        # Spread the changed files across the tree and each file's hunks across its lines
+        edits = self.rng.sample(self.paths, int(len(self.paths) * options["changed"]))
+        for path in edits:
+            for start in self.rng.sample(range(options["lines"]), min(options["hunks"], options["lines"])):
+                self.rewrite(path, start, self.rng.randint(1, 3))
+        yield self.commit(HEAD_BRANCH, (USER, "runner@example.com"), "Feature", edits)
+
+
+def generate(path, **options):
+    """Creates the repository at path, checked out on the feature branch, and returns its options"""
+    repo = SyntheticRepo(**options)
+    subprocess.check_call(["git", "init", "-q", path])
+    subprocess.check_call(["git", "-C", path, "config", "user.name", USER])
+    subprocess.check_call(["git", "-C", path, "config", "user.email", "runner@example.com"])
+
+    proc = subprocess.Popen(["git", "-C", path, "fast-import", "--quiet"], stdin=subprocess.PIPE)
+    for commit in repo.history():
+        proc.stdin.write(commit)
+    proc.stdin.close()
+    if proc.wait():
+        raise subprocess.CalledProcessError(proc.returncode, "git fast-import")
+
+    subprocess.check_call(["git", "-C", path, "checkout", "-q", "-f", HEAD_BRANCH])
+    return repo.options
+
+
+def add_options(parser):
+    parser.add_argument('--files', type=int, default=DEFAULTS["files"], help="Number of files")
+    parser.add_argument('--lines', type=int, default=DEFAULTS["lines"], help="Lines in each file")
+    parser.add_argument('--commits', type=int, default=DEFAULTS["commits"], help="Depth of the base history")
+    parser.add_argument('--authors', type=int, default=DEFAULTS["authors"], help="Number of authors")
+    parser.add_argument('--touched', type=int, default=DEFAULTS["touched"], help="Files edited by each commit")
+    parser.add_argument('--changed', type=float, default=DEFAULTS["changed"],
+                        help="Fraction of the files the feature branch changes")
+    parser.add_argument('--hunks', type=int, default=DEFAULTS["hunks"], help="Hunks in each changed file")
+    parser.add_argument('--seed', type=int, default=DEFAULTS["seed"], help="Seed for the random generator")
+
+
+def get_options(args):
+    return dict((key, getattr(args, key)) for key in DEFAULTS)
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Generate a deterministic git repository to benchmark against')
+    parser.add_argument('path', help="Where to create the repository")
+    add_options(parser)
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        shl.error("{path} already exists", path=args.path)
+        return 1
+
+    generate(args.path, **get_options(args))
+    shl.info("Generated {path}", path=args.path)
+
+
+if __name__ == "__main__":
+    run()
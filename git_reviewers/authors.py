@@ -0,0 +1,152 @@
+"""
+Interned author identities.  Each (name, email) pair blame reports is resolved through the
+repository's mailmap once and given a small integer id, and the tallies, scores and blamed
+lines of a run are all keyed on the ids, so one person's aliases are counted together and
+names are only looked up again for output.  People are told apart by their mailmapped name,
+as `git shortlog` groups them.
+"""
+import os
+import re
+import subprocess
+
+from git_reviewers.commands import run_cmd_async
+
+
+MAILMAP_ENTRY_RE = re.compile(r"\s*([^<]*?)\s*<([^>]*)>")
+
+AUTHORS = None
+
+
+class Mailmap(object):
+    """
+    A parsed `.mailmap`, mapping the (name, email) pairs of commits to their proper ones.
+    Entries are matched on the commit email, and the commit name when the entry gives one,
+    both case insensitively, like git does.
+    """
+    def __init__(self):
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add_line(self, line):
+        if line.startswith("#"):
+            return
+
+        parts = MAILMAP_ENTRY_RE.findall(line)
+        if not parts:
+            return
+        if len(parts) == 1:
+            (proper_name, commit_email), proper_email, commit_name = parts[0], None, None
+        else:
+            (proper_name, proper_email), (commit_name, commit_email) = parts[:2]
+
+        names = self.entries.setdefault(commit_email.lower(), {})
+        key = commit_name.lower() if commit_name else None
+        old_name, old_email = names.get(key, (None, None))
+        names[key] = (proper_name or old_name, proper_email or old_email)
+
+    def add_lines(self, lines):
+        for line in lines:
+            self.add_line(line)
+
+    def resolve(self, name, email):
+        """The proper (name, email) of a commit's author"""
+        names = self.entries.get((email or "").lower())
+        if not names:
+            return name, email
+
+        proper_name, proper_email = names.get((name or "").lower()) or names.get(None) or (None, None)
+        return proper_name or name, proper_email or email
+
+
+class AuthorTable(object):
+    def __init__(self, mailmap=None, toplevel=None):
+        self.mailmap = mailmap or Mailmap()
+        self.toplevel = toplevel
+        self.ids = {}
+        self.name_ids = {}
+        self.names = []
+        self.emails = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def get_id(self, name, email):
+        """The id of the author of a (name, email) pair from git, resolved through the mailmap"""
+        key = (name, email)
+        author_id = self.ids.get(key)
+        if author_id is None:
+            author_id = self.ids[key] = self.add(*self.mailmap.resolve(name, email))
+        return author_id
+
+    def add(self, name, email):
+        """The id of an already resolved author, such as one sent back by a worker process"""
+        author_id = self.name_ids.get(name)
+        if author_id is None:
+            author_id = self.name_ids[name] = len(self.names)
+            self.names.append(name)
+            self.emails.append(email)
+        return author_id
+
+    def get_commit_ids(self, commits):
+        """The author id of each of the commits blame read, by sha"""
+        return dict((sha, self.get_id(commit["author"], commit["email"])) for sha, commit in commits.items())
+
+    def find(self, name):
+        """The id of the author with the name, None if no blamed line is theirs"""
+        return self.name_ids.get(name)
+
+    def get_name(self, author_id):
+        return self.names[author_id]
+
+    def get_identities(self):
+        """The resolved (name, email) of each id, for a parent process to add the ids to its own table"""
+        return list(zip(self.names, self.emails))
+
+
+async def get_mailmap_config():
+    cmd = ["git", "config", "--get-regexp", r"^mailmap\."]
+    try:
+        lines = await run_cmd_async(cmd)
+    except subprocess.CalledProcessError:
+        return {} # None of it is set
+    return dict(line.partition(" ")[::2] for line in lines if line)
+
+
+async def read_mailmap(toplevel):
+    """
+    Reads the mailmap git would use: the `.mailmap` at the top of the working tree, then
+    `mailmap.file` and `mailmap.blob` when they are configured
+    """
+    mailmap = Mailmap()
+    config = await get_mailmap_config()
+    for path in (".mailmap", config.get("mailmap.file")):
+        path = path and os.path.join(toplevel, os.path.expanduser(path))
+        if path and os.path.isfile(path):
+            with open(path, errors="replace") as f:
+                mailmap.add_lines(f.read().split("\n"))
+
+    if config.get("mailmap.blob"):
+        try:
+            mailmap.add_lines(await run_cmd_async(["git", "cat-file", "blob", config["mailmap.blob"]]))
+        except subprocess.CalledProcessError:
+            pass # git ignores a blob that doesn't exist too
+
+    return mailmap
+
+
+async def open_authors(toplevel):
+    """Opens the author table of the repository with its mailmap and makes it the one used, once per repository"""
+    global AUTHORS
+    if AUTHORS is None or AUTHORS.toplevel != toplevel:
+        AUTHORS = AuthorTable(await read_mailmap(toplevel), toplevel)
+    return AUTHORS
+
+
+def get_authors():
+    """The author table in use, one without a mailmap if none was opened"""
+    global AUTHORS
+    if AUTHORS is None:
+        AUTHORS = AuthorTable()
+    return AUTHORS
@@ -0,0 +1,71 @@
+"""
+Ranking on a budget.  Rather than blaming every file before ranking, the files are blamed
+most changed lines first, so whenever the blaming has to stop the ranking is already based on
+the biggest part of the diff it could be, and the coverage says how big that part is.  The
+blaming can stop at a deadline, or once the top reviewers are settled.
+"""
+import heapq
+
+
+class DeadlineExceeded(Exception):
+    """Raised instead of starting a git command once the deadline has passed"""
+
+
+class Coverage(object):
+    """How many of the changed lines around the diff's hunks a ranking is based on"""
+    __slots__ = ("changed_lines", "blamed_lines", "skipped_files", "skipped_hunks", "settled")
+
+    def __init__(self):
+        self.changed_lines = self.blamed_lines = 0
+        self.skipped_files = self.skipped_hunks = 0
+        self.settled = False
+
+    def add_changed(self, lines):
+        self.changed_lines += lines
+
+    def add_blamed(self, lines):
+        self.blamed_lines += lines
+
+    def add_skipped(self, hunks):
+        self.skipped_files += 1
+        self.skipped_hunks += hunks
+
+    @property
+    def remaining_lines(self):
+        return self.changed_lines - self.blamed_lines
+
+    @property
+    def partial(self):
+        return self.blamed_lines < self.changed_lines or self.skipped_files > 0
+
+    @property
+    def ratio(self):
+        return self.blamed_lines / self.changed_lines if self.changed_lines else 1.0
+
+    def to_dict(self):
+        return dict(changed_lines=self.changed_lines, blamed_lines=self.blamed_lines, coverage=round(self.ratio, 4),
+                    partial=self.partial, skipped_files=self.skipped_files, skipped_hunks=self.skipped_hunks,
+                    settled=self.settled)
+
+
+def order_by_lines(diff_infos, get_lines):
+    """The diff infos with the most changed lines first, in diff order among equals"""
+    return sorted(diff_infos, key=lambda diff_info: -get_lines(diff_info))
+
+
+def is_top_settled(lines, top, remaining_lines):
+    """
+    Whether the top reviewers by lines are settled, given each reviewer's lines so far and the
+    number of changed lines left to blame.  Any of those could go to anyone, so a reviewer ends
+    up with between their lines so far and that plus the remaining lines, and their share of
+    the diff between those over the changed lines.  The top are settled once the least any of
+    them can end up with is more than the most anyone else can, a reviewer not seen yet included.
+    """
+    if not remaining_lines:
+        return True
+
+    leaders = heapq.nlargest(top + 1, lines)
+    if len(leaders) < top:
+        return False
+    runner_up = leaders[top] if len(leaders) > top else 0
+    return leaders[top - 1] > runner_up + remaining_lines
@@ -0,0 +1,145 @@
+"""
+Persistent cache kept in SQLite under the repository's git directory.  Blame output at a fixed
+commit never changes, so entries are keyed by the resolved commit sha, the path and the blamed
+line ranges and never go stale.  A file's blamed results are also kept, keyed by the base commit
+and the blob ids of both sides of its diff, so unchanged files are not re-diffed or re-blamed
+on the next run.  The least recently used entries are evicted once the stored output grows
+past the size limit.
+"""
+import json
+import os
+import sqlite3
+import time
+
+import python_lib.shell as shl
+
+
+CACHE_DIR = "reviewers-cache"
+MAX_SIZE = 64 * 1024 * 1024
+
+CACHE = None
+
+
+TABLES = dict(
+    blame=("commit_sha", "path", "ranges"),
+    results=("commit_sha", "from_hash", "to_hash", "path", "context"),
+)
+SCHEMA_VERSION = 2
+
+
+class BlameCache(object):
+    def __init__(self, path, max_size=MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.hits = dict((table, 0) for table in TABLES)
+        self.misses = dict((table, 0) for table in TABLES)
+        self.evictions = 0
+
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            for table in TABLES:
+                self.conn.execute("DROP TABLE IF EXISTS {table}".format(table=table)) # It's only a cache
+            self.conn.execute("PRAGMA user_version = {version}".format(version=SCHEMA_VERSION))
+        for table, key in TABLES.items():
+            self.conn.execute("CREATE TABLE IF NOT EXISTS {table} ({key}, output TEXT, size INTEGER, accessed REAL, "
+                              "PRIMARY KEY ({key}))".format(table=table, key=", ".join(key)))
+            self.conn.execute("CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed)".format(table=table))
+        self.conn.commit()
+        self.total_size = self.size() # Kept up to date by put and evict, rather than summed on each put
+
+    def where(self, table):
+        return " AND ".join(column + " = ?" for column in TABLES[table])
+
+    def get(self, table, key):
+        row = self.conn.execute("SELECT output FROM {table} WHERE {where}".format(table=table, where=self.where(table)),
+                                key).fetchone()
+        if row is None:
+            self.misses[table] += 1
+            return None
+
+        self.hits[table] += 1
+        self.conn.execute("UPDATE {table} SET accessed = ? WHERE {where}".format(table=table, where=self.where(table)),
+                          (time.time(),) + tuple(key))
+        self.conn.commit()
+        return row[0]
+
+    def put(self, table, key, output):
+        row = self.conn.execute("SELECT size FROM {table} WHERE {where}".format(table=table, where=self.where(table)),
+                                key).fetchone()
+        self.conn.execute("INSERT OR REPLACE INTO {table} VALUES ({values})".format(
+                              table=table, values=", ".join("?" * (len(key) + 3))),
+                          tuple(key) + (output, len(output), time.time()))
+        self.total_size += len(output) - (row[0] if row else 0)
+        if self.total_size > self.max_size:
+            self.evict()
+        self.conn.commit()
+
+    def get_blame(self, commit_sha, path, ranges):
+        output = self.get("blame", (commit_sha, path, ranges))
+        return None if output is None else output.split("\n")
+
+    def put_blame(self, commit_sha, path, ranges, lines):
+        self.put("blame", (commit_sha, path, ranges), "\n".join(lines))
+
+    def get_result(self, commit_sha, from_hash, to_hash, path, context):
+        output = self.get("results", (commit_sha, from_hash, to_hash, path, context))
+        return None if output is None else json.loads(output)
+
+    def put_result(self, commit_sha, from_hash, to_hash, path, context, result):
+        output = json.dumps(result, separators=(',', ':'), cls=shl.JSONEncoder)
+        self.put("results", (commit_sha, from_hash, to_hash, path, context), output)
+
+    def evict(self):
+        """Deletes the least recently used entries until the stored output fits in the size limit"""
+        size = self.size() # Counted afresh, other processes may have written to the cache too
+        if size <= self.max_size:
+            self.total_size = size
+            return
+
+        rows = self.conn.execute(" UNION ALL ".join("SELECT '{table}', rowid, size, accessed FROM {table}".format(table=table)
+                                                    for table in TABLES) + " ORDER BY accessed").fetchall()
+        for table, rowid, row_size, _ in rows:
+            if size <= self.max_size:
+                break
+            self.conn.execute("DELETE FROM {table} WHERE rowid = ?".format(table=table), (rowid,))
+            size -= row_size
+            self.evictions += 1
+        self.total_size = size
+
+    def size(self):
+        return sum(self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM {table}".format(table=table)).fetchone()[0]
+                   for table in TABLES)
+
+    def stats(self):
+        entries = sum(self.conn.execute("SELECT COUNT(*) FROM {table}".format(table=table)).fetchone()[0]
+                      for table in TABLES)
+        return dict(path=self.path, hits=self.hits["blame"], misses=self.misses["blame"],
+                    result_hits=self.hits["results"], result_misses=self.misses["results"],
+                    evictions=self.evictions, entries=entries, size=self.size(), max_size=self.max_size)
+
+    def close(self):
+        self.conn.close()
+
+
+def open_cache(git_dir, max_size=MAX_SIZE):
+    """Opens the cache under the git directory and makes it the one blame uses"""
+    global CACHE
+    cache_dir = os.path.join(git_dir, CACHE_DIR)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    CACHE = BlameCache(os.path.join(cache_dir, "blame.sqlite"), max_size)
+    return CACHE
+
+
+def open_memory_cache(max_size=MAX_SIZE):
+    """Opens a cache that only lasts as long as the process and makes it the one blame uses"""
+    global CACHE
+    CACHE = BlameCache(":memory:", max_size)
+    return CACHE
+
+
+def get_cache():
+    return CACHE
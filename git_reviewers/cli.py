@@ -1,35 +1,250 @@
 import argparse
-from os.path import abspath
+import sys
 
-from git_reviewers.reviewers import get_git_branches, get_reviewers
+from git_reviewers import planner, sampling, scoring
+from git_reviewers.commands import ReplayMissError, open_backend, run_sync
+from git_reviewers.reviewers import DEFAULT_CONTEXT, batch_reviewers, build_index, get_git_branches, get_reviewers
+from git_reviewers.server import run_server
+import python_lib.shell as shl
 
 
-def run():
-    parser = argparse.ArgumentParser(description="Get the suggested reviewers for a commit")
+def get_branch(branch):
+    if branch:
+        return branch
+    elif 'develop' in run_sync(get_git_branches()):
+        return 'develop'
+    else:
+        return 'master'
+
+
+def add_common_options(parser, branch_help, cache_help=None, context=True):
+    """
+    Adds the options the commands share: --branch with its help, --jobs and --timeout, then
+    --context unless the command takes it another way, and --no-cache with its help if the
+    command has a cache to turn off
+    """
     parser.add_argument('--branch', '-b',
                         required=False,
-                        help="Check for a PR against a specific branch")
+                        help=branch_help)
+    parser.add_argument('--jobs', '-j',
+                        required=False,
+                        type=int,
+                        help="The number of git commands to run in parallel.  Defaults to the number of CPUs")
+    parser.add_argument('--timeout',
+                        required=False,
+                        type=float,
+                        help="Fail if a single git command takes longer than this many seconds")
+    if context:
+        parser.add_argument('--context', '-U',
+                            required=False,
+                            type=int,
+                            default=DEFAULT_CONTEXT,
+                            help="The number of lines around each change to blame, overlapping ranges are only "
+                            "blamed once.  Defaults to %(default)s")
+    if cache_help:
+        parser.add_argument('--no-cache',
+                            dest='use_cache',
+                            action='store_false',
+                            help=cache_help)
+
+
+def check_common_options(parser, args):
+    """Rejects the values of the options add_common_options adds that git can't take"""
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if getattr(args, "context", 0) < 0:
+        parser.error("--context can't be negative")
+
+
+def run_index(argv):
+    parser = argparse.ArgumentParser(prog="git reviewers index",
+                                     description="Manage the line ownership index used instead of git blame")
+    parser.add_argument('action', choices=['build'],
+                        help="build: blame every file at the branch and store who owns each line")
+    add_common_options(parser, "The branch to index, the one you open PRs against", context=False)
+    args = parser.parse_args(argv)
+    check_common_options(parser, args)
+
+    build_index(get_branch(args.branch), args.jobs, args.timeout)
+
+
+def read_pairs(lines, default_base):
+    """Reads `head [base]` pairs, one per line, skipping blank lines and # comments"""
+    pairs = []
+    for line in lines:
+        parts = line.split("#", 1)[0].split()
+        if parts:
+            pairs.append((parts[0], parts[1] if len(parts) > 1 else default_base))
+    return pairs
+
+
+def run_batch(argv):
+    parser = argparse.ArgumentParser(prog="git reviewers batch",
+                                     description="Get the suggested reviewers for many branches in one run, writing "
+                                     "one line of JSON per branch")
+    parser.add_argument('pairs', nargs='?', default='-',
+                        help="A file of `head [base]` ref pairs, one per line.  Reads stdin when - or left out")
+    add_common_options(parser, "The base for pairs that don't give one",
+                       "Don't read or write the blame cache in .git/reviewers-cache, blame is still shared between "
+                       "the pairs in memory")
+    args = parser.parse_args(argv)
+    check_common_options(parser, args)
+
+    if args.pairs == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(args.pairs) as f:
+            lines = f.readlines()
+
+    batch_reviewers(read_pairs(lines, get_branch(args.branch)), args.jobs, args.timeout, args.use_cache, args.context)
+
+
+def run_serve(argv):
+    parser = argparse.ArgumentParser(prog="git reviewers serve",
+                                     description="Answer reviewer queries for this repository over HTTP, keeping "
+                                     "caches and git processes warm between them")
+    address = parser.add_mutually_exclusive_group()
+    address.add_argument('--socket',
+                         required=False,
+                         help="The Unix socket to listen on.  Defaults to .git/reviewers-cache/server.sock")
+    address.add_argument('--port',
+                         required=False,
+                         type=int,
+                         help="Listen on this localhost port instead of a Unix socket, 0 picks a free one")
+    add_common_options(parser, "The base for queries that don't give one",
+                       "Don't read or write the blame cache in .git/reviewers-cache, keep it in memory",
+                       context=False) # Each query gives its own
+    args = parser.parse_args(argv)
+    check_common_options(parser, args)
+
+    run_server(get_branch(args.branch), args.socket, args.port, args.jobs, args.timeout, args.use_cache)
+
+
+def run():
+    if sys.argv[1:2] == ['index']:
+        return run_index(sys.argv[2:])
+    if sys.argv[1:2] == ['batch']:
+        return run_batch(sys.argv[2:])
+    if sys.argv[1:2] == ['serve']:
+        return run_serve(sys.argv[2:])
+
+    parser = argparse.ArgumentParser(description="Get the suggested reviewers for a commit")
+    add_common_options(parser, "Check for a PR against a specific branch",
+                       "Don't read or write the blame cache in .git/reviewers-cache")
     parser.add_argument('--contributor', '-c',
                         required=False,
                         help="View lines of code for a specific contributor")
     parser.add_argument('--output', '-o',
                         required=False,
                         default="default",
-                        help="The output format: default|raw.  Raw dumps json in-memory data structures for debugging and"
-                        "consumption by other applications.")
+                        help="The output format: default|raw|ndjson.  Raw dumps the in-memory data structures for debugging. "
+                        "Ndjson writes one line of JSON per file as soon as it is blamed, then a summary line with "
+                        "the suggested reviewers, for consumption by other applications.")
+    parser.add_argument('--deadline',
+                        required=False,
+                        type=float,
+                        metavar='SECONDS',
+                        help="Rank the reviewers after at most about this many seconds, blaming the files with the "
+                        "most changed lines first.  If time runs out the ranking is marked partial, with how many "
+                        "of the changed lines it is based on")
+    parser.add_argument('--top',
+                        required=False,
+                        type=int,
+                        metavar='K',
+                        help="Only suggest the top K reviewers, and stop blaming once no more changed lines could "
+                        "change who they are.  Their lines and shares are of the lines blamed until then")
+    parser.add_argument('--sample',
+                        required=False,
+                        type=int,
+                        metavar='HUNKS',
+                        help="For giant diffs, estimate the reviewers from a sample of this many hunks spread across "
+                        "directories, the bigger hunks more likely, with a 95%% confidence interval on each share")
+    parser.add_argument('--seed',
+                        required=False,
+                        type=int,
+                        default=sampling.DEFAULT_SEED,
+                        help="The seed the --sample is drawn with, the same seed draws the same sample of the same "
+                        "diff.  Defaults to %(default)s")
+    parser.add_argument('--processes', '-P',
+                        required=False,
+                        type=int,
+                        help="Shard the changed files by directory across this many worker processes, for diffs "
+                        "touching tens of thousands of files.  Only for the default output")
+    parser.add_argument('--score',
+                        required=False,
+                        default="lines",
+                        choices=scoring.STRATEGIES,
+                        help="How to weigh the blamed lines of each reviewer.  lines: count them, recency: weigh each "
+                        "line by how recent its commit is, per-file: make every file count the same.  The ndjson "
+                        "summary has the scores of all of them.  Defaults to %(default)s")
+    parser.add_argument('--half-life',
+                        required=False,
+                        type=float,
+                        default=scoring.HALF_LIFE_DAYS,
+                        help="For --score recency, the number of days over which a line's weight halves.  Defaults "
+                        "to %(default)s")
+    parser.add_argument('--whole-file-threshold',
+                        required=False,
+                        type=float,
+                        help="Blame a file with many hunks whole once blaming its hunks is estimated to cost this "
+                        "fraction of blaming the whole file.  Defaults to {threshold}".format(
+                            threshold=planner.WHOLE_FILE_THRESHOLD))
+    parser.add_argument('--cache-stats',
+                        action='store_true',
+                        help="Print blame cache hits, misses and size")
+    parser.add_argument('--profile',
+                        action='store_true',
+                        help="Print how long each stage, file and git command took")
+    parser.add_argument('--profile-trace',
+                        required=False,
+                        metavar='FILE',
+                        help="Also write the timings to FILE as Chrome trace events, for chrome://tracing or "
+                        "ui.perfetto.dev.  Implies --profile")
+    recording = parser.add_mutually_exclusive_group()
+    recording.add_argument('--record',
+                           required=False,
+                           metavar='FILE',
+                           help="Write every git command run, with its output, to FILE")
+    recording.add_argument('--replay',
+                           required=False,
+                           metavar='FILE',
+                           help="Answer the git commands from a FILE written by --record instead of running git, "
+                           "to test or time everything but git itself")
     parser.add_argument('files', metavar='file', type=str, nargs='*',
-                        help='Only show reviewers for certain files. If none specified, shows reviewers for all files')
+                        help='Only show reviewers for certain files, directories or git pathspecs such as "src/**/*.py" or '
+                        '":!vendor". If none specified, shows reviewers for all files')
     args = parser.parse_args()
+    check_common_options(parser, args)
+    if args.processes and args.processes > 1 and (args.contributor or args.output != "default"):
+        parser.error("--processes only works with the default output")
+    if args.deadline is not None and args.deadline <= 0:
+        parser.error("--deadline must be a positive number of seconds")
+    if args.top is not None:
+        if args.top < 1:
+            parser.error("--top must be at least 1")
+        if args.score != "lines":
+            parser.error("--top only works with --score lines")
+    if args.sample is not None:
+        if args.sample < sampling.MIN_DRAWS:
+            parser.error("--sample must be at least {min_draws} hunks, for a spread to estimate the error "
+                         "from".format(min_draws=sampling.MIN_DRAWS))
+        if args.deadline is not None or args.top is not None or args.score != "lines":
+            parser.error("--sample can't be combined with --deadline, --top or --score")
+    if args.deadline is not None or args.top is not None or args.sample is not None:
+        if args.contributor or args.output == "raw" or (args.processes and args.processes > 1):
+            parser.error("--deadline, --top and --sample only work with the default and ndjson outputs, in one "
+                         "process")
 
+    backend = open_backend(args.record, args.replay)
+    try:
+        branch = get_branch(args.branch)
 
-    if args.branch:
-        branch = args.branch
-    elif 'develop' in get_git_branches():
-        branch = 'develop'
-    else:
-        branch = 'master'
-
-    if args.files:
-        args.files = [abspath(path) for path in args.files]
-
-    get_reviewers(args.contributor, branch, args.files, args.output)
+        get_reviewers(args.contributor, branch, args.files, args.output, args.jobs, args.timeout,
+                      args.use_cache, args.cache_stats, args.context, args.whole_file_threshold, args.profile,
+                      args.profile_trace, args.processes, args.score, args.half_life, args.deadline,
+                      args.top, args.sample, args.seed)
+    except ReplayMissError as e:
+        shl.error("\n{error}\nReplay with the options the commands were recorded with\n", error=e)
+        sys.exit(5)
+    finally:
+        backend.close()
@@ -0,0 +1,307 @@
+"""
+Runs git commands as asyncio subprocesses, with a synchronous facade for the CLI.  The commands
+go through a backend, which can record them with their output to a fixture file and replay them
+later without running git, so the parsing and ranking can be tested and timed on their own.
+"""
+import asyncio
+import json
+from os import cpu_count
+import subprocess
+import time
+import weakref
+
+from git_reviewers import profile
+
+
+MAX_JOBS = cpu_count() or 1
+TIMEOUT = None
+STREAM_CHUNK = 64 * 1024
+FIXTURE_VERSION = 1
+
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def configure(jobs=None, timeout=None):
+    """Sets how many commands may run at once and how many seconds each may take"""
+    global MAX_JOBS, TIMEOUT
+    if jobs:
+        MAX_JOBS = jobs
+    TIMEOUT = timeout
+
+
+def ensure_str(data):
+    if type(data) != str:
+        return data.decode("utf-8")
+    return data
+
+
+def split_output(output):
+    return ensure_str(output).strip().split("\n")
+
+
+def get_semaphore():
+    """Gets the semaphore bounding concurrent commands, asyncio primitives belong to a single loop"""
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(MAX_JOBS)
+    return semaphore
+
+
+class ReplayMissError(LookupError):
+    pass
+
+
+class SubprocessBackend(object):
+    """Runs the commands as git subprocesses"""
+    async def run(self, cmd, timeout=None):
+        queued = time.perf_counter()
+        async with get_semaphore():
+            start = time.perf_counter()
+            proc = await asyncio.create_subprocess_exec(*cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            try:
+                stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+            except asyncio.TimeoutError:
+                await kill(proc)
+                profile.record_command(cmd, start, 0, "timeout", start - queued)
+                raise subprocess.TimeoutExpired(cmd, timeout)
+            except asyncio.CancelledError:
+                await kill(proc)
+                profile.record_command(cmd, start, 0, "cancelled", start - queued)
+                raise
+
+        profile.record_command(cmd, start, len(stdout), proc.returncode, start - queued)
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, cmd, stdout, stderr)
+
+        return stdout
+
+    async def stream(self, cmd, timeout=None):
+        start = time.perf_counter()
+        size = 0
+        proc = await asyncio.create_subprocess_exec(*cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            buffered = b""
+            while True:
+                try:
+                    data = await asyncio.wait_for(proc.stdout.read(STREAM_CHUNK), timeout)
+                except asyncio.TimeoutError:
+                    raise subprocess.TimeoutExpired(cmd, timeout)
+                if not data:
+                    break
+                size += len(data)
+
+                lines = (buffered + data).split(b"\n")
+                buffered = lines.pop()
+                for line in lines:
+                    yield ensure_str(line)
+
+            if buffered:
+                yield ensure_str(buffered)
+
+            stderr = await proc.stderr.read()
+            if await proc.wait():
+                raise subprocess.CalledProcessError(proc.returncode, cmd, None, stderr)
+        finally:
+            await kill(proc)
+            profile.record_command(cmd, start, size, proc.returncode)
+
+    def close(self):
+        pass
+
+
+class RecordingBackend(object):
+    """Runs the commands through another backend and writes them with their output to a fixture file on close"""
+    def __init__(self, path, backend=None):
+        self.path = path
+        self.backend = backend or SubprocessBackend()
+        self.commands = []
+
+    async def run(self, cmd, timeout=None):
+        try:
+            stdout = await self.backend.run(cmd, timeout)
+        except subprocess.CalledProcessError as e:
+            self.commands.append(dict(cmd=cmd, stdout=ensure_str(e.output or b""), status=e.returncode,
+                                      stderr=ensure_str(e.stderr or b"")))
+            raise
+
+        self.commands.append(dict(cmd=cmd, stdout=ensure_str(stdout), status=0))
+        return stdout
+
+    async def stream(self, cmd, timeout=None):
+        lines = []
+        command = dict(cmd=cmd, lines=lines, status=0)
+        stream = self.backend.stream(cmd, timeout)
+        try:
+            async for line in stream:
+                lines.append(line)
+                yield line
+        except subprocess.CalledProcessError as e:
+            command.update(status=e.returncode, stderr=ensure_str(e.stderr or b""))
+            raise
+        finally:
+            await stream.aclose()
+            self.commands.append(command) # Even when the reader stops early, it will stop there again
+
+    def close(self):
+        with open(self.path, "w") as f:
+            json.dump(dict(version=FIXTURE_VERSION, commands=self.commands), f)
+        self.backend.close()
+
+
+class ReplayBackend(object):
+    """
+    Answers the commands from a fixture file written by RecordingBackend, without running git.
+    A command that was recorded more than once is answered in the recorded order, then with
+    its last output.  Raises ReplayMissError for a command that wasn't recorded.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path) as f:
+            fixture = json.load(f)
+        if fixture.get("version") != FIXTURE_VERSION:
+            raise ValueError("{path} is not a version {version} command fixture".format(path=path,
+                                                                                      version=FIXTURE_VERSION))
+
+        self.recorded = {}
+        for command in fixture["commands"]:
+            self.recorded.setdefault(tuple(command["cmd"]), []).append(command)
+
+    def get_command(self, cmd):
+        recorded = self.recorded.get(tuple(cmd))
+        if not recorded:
+            raise ReplayMissError("{path} has no recording of: {cmd}".format(path=self.path, cmd=" ".join(cmd)))
+        return recorded.pop(0) if len(recorded) > 1 else recorded[0]
+
+    def raise_status(self, cmd, command, stdout):
+        if command["status"]:
+            raise subprocess.CalledProcessError(command["status"], cmd, stdout,
+                                                command.get("stderr", "").encode("utf-8"))
+
+    async def run(self, cmd, timeout=None):
+        command = self.get_command(cmd)
+        stdout = command["stdout"].encode("utf-8")
+        self.raise_status(cmd, command, stdout)
+        return stdout
+
+    async def stream(self, cmd, timeout=None):
+        command = self.get_command(cmd)
+        for line in command["lines"]:
+            yield line
+        self.raise_status(cmd, command, None)
+
+    def close(self):
+        pass
+
+
+class CatFile(object):
+    """
+    A long running `git cat-file --batch` reading objects by name, so a long running process
+    can resolve refs and read blobs without starting a git process for each one.  The process
+    is started on first use, and again if it dies.
+    """
+    def __init__(self):
+        self.proc = None
+        self.lock = asyncio.Lock()
+
+    async def start(self):
+        self.proc = await asyncio.create_subprocess_exec("git", "cat-file", "--batch", stdin=subprocess.PIPE,
+                                                         stdout=subprocess.PIPE)
+
+    async def get(self, name):
+        """Gets the (sha, type, contents) of the named object, None when there isn't one"""
+        if "\n" in name:
+            raise ValueError("Object names can't contain newlines: {name!r}".format(name=name))
+
+        async with self.lock:
+            if self.proc is None or self.proc.returncode is not None:
+                await self.start()
+
+            start = time.perf_counter()
+            self.proc.stdin.write(name.encode("utf-8") + b"\n")
+            await self.proc.stdin.drain()
+            header = ensure_str(await self.proc.stdout.readline()).rstrip("\n")
+            parts = header.split(" ")
+            if len(parts) != 3:
+                profile.record_command(["git", "cat-file", "--batch", name], start, 0, parts[-1])
+                return None # missing or ambiguous
+
+            data = await self.proc.stdout.readexactly(int(parts[2]) + 1)
+            profile.record_command(["git", "cat-file", "--batch", name], start, len(data), 0)
+            return parts[0], parts[1], data[:-1]
+
+    async def close(self):
+        if self.proc and self.proc.returncode is None:
+            self.proc.stdin.close()
+            await self.proc.wait()
+
+
+BACKEND = SubprocessBackend()
+CAT_FILE = None
+
+
+def set_backend(backend):
+    """Sets the backend all of the commands go through and returns the one it replaces"""
+    global BACKEND
+    previous, BACKEND = BACKEND, backend
+    return previous
+
+
+def get_backend():
+    return BACKEND
+
+
+def set_cat_file(cat_file):
+    """Sets the long running cat-file that refs and blobs are read through, None to start git for each"""
+    global CAT_FILE
+    CAT_FILE = cat_file
+
+
+def get_cat_file():
+    return CAT_FILE
+
+
+def open_backend(record=None, replay=None):
+    """Opens the backend for the --record and --replay options and makes it the one commands go through"""
+    if replay:
+        set_backend(ReplayBackend(replay))
+    elif record:
+        set_backend(RecordingBackend(record))
+    return BACKEND
+
+
+async def run_cmd_async(cmd, timeout=None):
+    """
+    Runs the command and returns its output lines.  Raises CalledProcessError on a non-zero exit
+    and TimeoutExpired if it runs longer than the timeout.  The process is killed if the
+    command times out or the awaiting task is cancelled.
+    """
+    if isinstance(cmd, str):
+        cmd = cmd.split(" ")
+    return split_output(await BACKEND.run(cmd, timeout or TIMEOUT))
+
+
+def stream_cmd_async(cmd, timeout=None):
+    """
+    Runs the command and yields its output lines as they are read, so the whole output is
+    never held in memory.  The timeout applies to each read rather than the whole command.
+    Streams don't take a slot from the semaphore, their consumers start the commands that do.
+    """
+    if isinstance(cmd, str):
+        cmd = cmd.split(" ")
+    return BACKEND.stream(cmd, timeout or TIMEOUT)
+
+
+async def kill(proc):
+    if proc.returncode is None:
+        proc.kill()
+    await proc.wait()
+
+
+def run_sync(coro):
+    """Runs a coroutine to completion from synchronous code"""
+    return asyncio.run(coro)
+
+
+def run_cmd(cmd, timeout=None):
+    return run_sync(run_cmd_async(cmd, timeout))
@@ -0,0 +1,204 @@
+"""
+Precomputed line ownership index.  `git reviewers index build` blames every file at a commit
+once and stores who owns each range of lines, so later runs can answer hunk ranges without
+running `git blame`.  A path is only answered from the index when the blamed commit is the
+indexed commit, or a descendant of it whose history hasn't touched the path since.
+"""
+import asyncio
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+
+from git_reviewers.cache import CACHE_DIR
+from git_reviewers.commands import run_cmd_async
+import python_lib.shell as shl
+
+
+INCREMENTAL_HEADER_RE = re.compile(r"^([0-9a-f]{40,64}) \d+ (\d+) (\d+)$")
+
+INDEX = None
+
+
+class OwnershipIndex(object):
+    def __init__(self, path):
+        self.path = path
+        self.fresh = {}
+
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS commits "
+                          "(id INTEGER PRIMARY KEY, sha TEXT UNIQUE, author TEXT, email TEXT, time INTEGER)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS paths (id INTEGER PRIMARY KEY, path TEXT UNIQUE)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS ranges (path_id INTEGER, start INTEGER, count INTEGER, "
+                          "commit_id INTEGER)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ranges_path ON ranges (path_id, start)")
+        self.conn.commit()
+
+    @property
+    def commit(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'commit'").fetchone()
+        return row[0] if row else None
+
+    def replace(self, commit_sha, commits, file_ranges):
+        """Replaces the index with the ranges of each path at the commit"""
+        with self.conn:
+            for table in ("meta", "commits", "paths", "ranges"):
+                self.conn.execute("DELETE FROM {table}".format(table=table))
+
+            commit_ids = {}
+            for sha, commit in commits.items():
+                cursor = self.conn.execute("INSERT INTO commits (sha, author, email, time) VALUES (?, ?, ?, ?)",
+                                           (sha, commit["author"], commit["email"], commit["time"]))
+                commit_ids[sha] = cursor.lastrowid
+
+            for path, ranges in file_ranges.items():
+                path_id = self.conn.execute("INSERT INTO paths (path) VALUES (?)", (path,)).lastrowid
+                self.conn.executemany("INSERT INTO ranges VALUES (?, ?, ?, ?)",
+                                      ((path_id, start, count, commit_ids[sha]) for start, count, sha in ranges))
+
+            self.conn.execute("INSERT INTO meta VALUES ('commit', ?)", (commit_sha,))
+        self.fresh = {}
+
+    async def prepare(self, commit_sha):
+        """Works out which paths the index can answer for blame at the commit"""
+        if commit_sha in self.fresh:
+            return
+
+        indexed = self.commit
+        if indexed is None:
+            self.fresh[commit_sha] = None
+        elif indexed == commit_sha:
+            self.fresh[commit_sha] = set()
+        elif await is_ancestor(indexed, commit_sha):
+            cmd = ["git", "log", "--format=", "--name-only", "--no-renames", "-z", indexed + ".." + commit_sha]
+            self.fresh[commit_sha] = set(path for path in "\n".join(await run_cmd_async(cmd)).split("\0") if path)
+        else:
+            self.fresh[commit_sha] = None
+
+    def is_fresh(self, commit_sha, path):
+        stale_paths = self.fresh.get(commit_sha)
+        return stale_paths is not None and path not in stale_paths
+
+    def query(self, commit_sha, path, chunks, commits):
+        """
+        Answers blame for the chunks of the path with (line_num, sha, code_line) records, like
+        `read_blame_porcelain` but with None for the code.  Returns None when the index can't answer.
+        """
+        if not self.is_fresh(commit_sha, path):
+            return None
+
+        row = self.conn.execute("SELECT id FROM paths WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return None
+
+        owners = {}
+        for chunk in chunks:
+            start_line, end_line = chunk.start_line, chunk.end_line
+            rows = self.conn.execute("SELECT r.start, r.count, c.sha, c.author, c.email, c.time "
+                                     "FROM ranges r JOIN commits c ON c.id = r.commit_id "
+                                     "WHERE r.path_id = ? AND r.start < ? AND r.start + r.count > ?",
+                                     (row[0], end_line, start_line))
+            for start, count, sha, author, email, time in rows:
+                if sha not in commits:
+                    commits[sha] = dict(sha=sha, author=sys.intern(author), email=email, time=time)
+                sha = commits[sha]["sha"]
+                for line_num in range(max(start, start_line), min(start + count, end_line)):
+                    owners[line_num] = sha
+
+        return [(line_num, owners[line_num], None) for line_num in sorted(owners)]
+
+    def close(self):
+        self.conn.close()
+
+
+def get_index_path(git_dir):
+    return os.path.join(git_dir, CACHE_DIR, "index.sqlite")
+
+
+def open_index(git_dir):
+    """Opens the index under the git directory if one has been built and makes it the one blame uses"""
+    global INDEX
+    path = get_index_path(git_dir)
+    INDEX = OwnershipIndex(path) if os.path.exists(path) else None
+    return INDEX
+
+
+def get_index():
+    return INDEX
+
+
+async def is_ancestor(ancestor, commit_sha):
+    try:
+        await run_cmd_async(["git", "merge-base", "--is-ancestor", ancestor, commit_sha])
+        return True
+    except subprocess.CalledProcessError:
+        return False
+
+
+def read_blame_incremental(blame, commits):
+    """Parses `git blame --incremental` output into (start, count, sha) ranges"""
+    ranges = []
+    sha = None
+    for line in blame:
+        match = INCREMENTAL_HEADER_RE.match(line)
+        if match:
+            sha = match.group(1)
+            ranges.append((int(match.group(2)), int(match.group(3)), sha))
+            if sha not in commits:
+                commits[sha] = dict(sha=sha, author=None, email=None, time=None)
+            continue
+
+        key, _, value = line.partition(" ")
+        if key == "author":
+            commits[sha]["author"] = sys.intern(value)
+        elif key == "author-mail":
+            commits[sha]["email"] = value.strip("<>")
+        elif key == "author-time":
+            commits[sha]["time"] = int(value)
+
+    return sorted(ranges)
+
+
+async def get_file_ranges(toplevel, commit_sha, path, commits):
+    """The blamed ranges of the file, None if blame fails on it"""
+    cmd = ["git", "-C", toplevel, "--no-pager", "blame", "--incremental", commit_sha, "--", path]
+    try:
+        return read_blame_incremental(await run_cmd_async(cmd), commits)
+    except subprocess.CalledProcessError:
+        return None
+
+
+async def get_blob_paths(commit_sha):
+    """The paths of the files at the commit, leaving out submodules, which blame can't read"""
+    cmd = ["git", "ls-tree", "-r", "-z", "--full-tree", commit_sha]
+    entries = [entry.partition("\t") for entry in "\n".join(await run_cmd_async(cmd)).split("\0") if entry]
+    return [path for info, _, path in entries if info.split(" ")[1] == "blob"]
+
+
+async def build_index(git_dir, commit_sha, toplevel):
+    """
+    Blames every file at the commit and stores the line ownership in the index.  Files blame
+    fails on are left out, and blamed as usual when a diff changes them.
+    """
+    paths = await get_blob_paths(commit_sha)
+
+    shl.info("Indexing {count} files at {commit}", count=len(paths), commit=commit_sha)
+    commits = {}
+    file_ranges = dict((path, ranges) for path, ranges in
+                       zip(paths, await asyncio.gather(*[get_file_ranges(toplevel, commit_sha, path, commits)
+                                                         for path in paths]))
+                       if ranges is not None)
+    if len(file_ranges) < len(paths):
+        shl.warning("Left {count} files that couldn't be blamed out of the index", count=len(paths) - len(file_ranges))
+
+    cache_dir = os.path.join(git_dir, CACHE_DIR)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    index = OwnershipIndex(get_index_path(git_dir))
+    index.replace(commit_sha, commits, file_ranges)
+    shl.info("Indexed {ranges} line ranges from {commits} commits",
+             ranges=sum(len(ranges) for ranges in file_ranges.values()), commits=len(commits))
+    return index
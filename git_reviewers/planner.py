@@ -0,0 +1,56 @@
+"""
+Decides how to blame a file.  git blame pays a setup cost for every `-L` range on top of the
+lines it tracks, so a file with many small hunks scattered across it is cheaper to blame whole
+and slice the needed lines out of afterwards.
+"""
+
+RANGE_COST = 20
+WHOLE_FILE_THRESHOLD = 1.0
+MIN_HUNKS = 8
+
+
+def configure(whole_file_threshold=None, range_cost=None):
+    """
+    Sets when to blame whole files: once the estimated cost of the ranges reaches
+    `whole_file_threshold` times the cost of the whole file.  Each range costs as much as
+    blaming `range_cost` lines.
+    """
+    global WHOLE_FILE_THRESHOLD, RANGE_COST
+    if whole_file_threshold is not None:
+        WHOLE_FILE_THRESHOLD = whole_file_threshold
+    if range_cost is not None:
+        RANGE_COST = range_cost
+
+
+def get_ranges_cost(chunks):
+    return sum(chunk.num_lines for chunk in chunks) + len(chunks) * RANGE_COST
+
+
+def may_blame_whole_file(chunks):
+    """
+    Whether it's worth finding out how long the file is.  Files with only a few hunks are left
+    alone, and the file is at least as long as its last hunk.
+    """
+    if len(chunks) < MIN_HUNKS:
+        return False
+    return get_ranges_cost(chunks) >= WHOLE_FILE_THRESHOLD * (chunks[-1].end_line - 1)
+
+
+def should_blame_whole_file(chunks, num_lines):
+    return get_ranges_cost(chunks) >= WHOLE_FILE_THRESHOLD * num_lines
+
+
+def slice_records(records, chunks):
+    """Keeps the blame records of a whole file that fall inside the sorted, disjoint chunks"""
+    sliced = []
+    chunk_idx = 0
+    for record in records:
+        line_num = record[0]
+        while chunk_idx < len(chunks) and chunks[chunk_idx].end_line <= line_num:
+            chunk_idx += 1
+        if chunk_idx == len(chunks):
+            break
+        if chunks[chunk_idx].start_line <= line_num:
+            sliced.append(record)
+
+    return sliced
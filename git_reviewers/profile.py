@@ -0,0 +1,187 @@
+"""
+Profiling for `--profile`.  Every git command and each stage of the pipeline is timed while a
+profiler is enabled, and the timings can be summarized or dumped as Chrome trace events, which
+load in chrome://tracing or https://ui.perfetto.dev.  With no profiler enabled the hooks do
+nothing.
+"""
+from contextlib import contextmanager
+import contextvars
+import json
+import os
+import sys
+import time
+
+import python_lib.shell as shl
+
+
+TOP = 10
+
+PROFILER = None
+CURRENT_FILE = contextvars.ContextVar("current_file", default=None) # Each blame task has its own
+
+
+class Profiler(object):
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.end = self.cpu_end = None
+        self.commands = []
+        self.stages = []
+
+    def add_command(self, cmd, start, end, size, status, wait=0, file=None):
+        self.commands.append(dict(cmd=" ".join(cmd), start=start, end=end, size=size, status=status, wait=wait,
+                                  file=file))
+
+    def add_stage(self, name, start, end, args):
+        self.stages.append(dict(name=name, start=start, end=end, args=args))
+
+    def stop(self):
+        self.end = time.perf_counter()
+        self.cpu_end = time.process_time()
+
+    @property
+    def wall_time(self):
+        return (self.end or time.perf_counter()) - self.start
+
+    @property
+    def cpu_time(self):
+        return (self.cpu_end or time.process_time()) - self.cpu_start
+
+    def get_git_time(self):
+        """The summed time of the git commands, and the time at least one of them was running"""
+        total = busy = 0
+        busy_until = None
+        for command in sorted(self.commands, key=lambda command: command["start"]):
+            total += command["end"] - command["start"]
+            if busy_until is None or command["start"] >= busy_until:
+                busy += command["end"] - command["start"]
+                busy_until = command["end"]
+            elif command["end"] > busy_until:
+                busy += command["end"] - busy_until
+                busy_until = command["end"]
+        return total, busy
+
+    def get_file_times(self):
+        """The time spent in git on each file's commands, and waiting for a --jobs slot to run them"""
+        files = {}
+        for command in self.commands:
+            if command["file"] is not None:
+                git_time, wait = files.get(command["file"], (0, 0))
+                files[command["file"]] = (git_time + command["end"] - command["start"], wait + command["wait"])
+        return files
+
+    def get_trace_events(self):
+        """
+        Converts the timings to Chrome "complete" trace events.  Commands and blames overlap, so
+        each is put on the first thread lane that is free when it starts.
+        """
+        events = []
+        lanes = []
+        spans = [(stage["start"], stage["end"], stage["name"], "stage", stage["args"]) for stage in self.stages]
+        spans += [(command["start"], command["end"], command["cmd"], "git",
+                   dict(size=command["size"], status=command["status"], wait=command["wait"], file=command["file"]))
+                  for command in self.commands]
+        for start, end, name, category, args in sorted(spans, key=lambda span: (span[0], -span[1])):
+            for lane, lane_end in enumerate(lanes):
+                if lane_end <= start:
+                    break
+            else:
+                lane = len(lanes)
+                lanes.append(None)
+            lanes[lane] = end
+
+            events.append(dict(name=name, cat=category, ph="X", pid=os.getpid(), tid=lane,
+                               ts=round((start - self.start) * 1e6), dur=round((end - start) * 1e6), args=args))
+        return events
+
+
+def enable():
+    global PROFILER
+    PROFILER = Profiler()
+    return PROFILER
+
+
+def get_profiler():
+    return PROFILER
+
+
+def record_command(cmd, start, size, status, wait=0):
+    """Records a git command that ran from start, after waiting `wait` seconds for a slot to run in"""
+    if PROFILER:
+        PROFILER.add_command(cmd, start, time.perf_counter(), size, status, wait, CURRENT_FILE.get())
+
+
+def set_file(path):
+    """Tags the git commands of the running task with the file they are for"""
+    CURRENT_FILE.set(path)
+
+
+@contextmanager
+def stage(name, **args):
+    """Times the block as a stage, the block can add to the args it yields while it runs"""
+    if not PROFILER:
+        yield args
+        return
+
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        PROFILER.add_stage(name, start, time.perf_counter(), args)
+
+
+def print_table(headers, *rows):
+    """Prints the rows to stderr under the headers, in columns as wide as their widest item"""
+    rows = [headers] + [[str(item) for item in row] for row in rows]
+    widths = [max(len(row[idx]) for row in rows) for idx, _ in enumerate(headers)]
+    for row_idx, row in enumerate(rows):
+        pad = "<" if row_idx == 0 else ">"
+        line = " | ".join(("{item:" + pad + str(width) + "}").format(item=item) for item, width in zip(row, widths))
+        shl.write_output(sys.stderr, "| " + line + " |")
+
+
+def print_summary(profiler):
+    git_total, git_busy = profiler.get_git_time()
+    shl.print_section(shl.BOLD, "Profile:")
+    shl.stderr("Wall time: {wall:.3f}s  Python CPU time: {cpu:.3f}s\n"
+               "git: {count} commands, {total:.3f}s in total, {busy:.3f}s with at least one running, "
+               "{size} bytes of output\n",
+               wall=profiler.wall_time, cpu=profiler.cpu_time, count=len(profiler.commands), total=git_total,
+               busy=git_busy, size=sum(command["size"] for command in profiler.commands))
+
+    stages = {}
+    for item in profiler.stages:
+        count, total, longest = stages.get(item["name"], (0, 0, 0))
+        duration = item["end"] - item["start"]
+        stages[item["name"]] = (count + 1, total + duration, max(longest, duration))
+    print_table(["Stage", "Count", "Total (s)", "Longest (s)"],
+                *[[name, count, "{:.3f}".format(total), "{:.3f}".format(longest)]
+                  for name, (count, total, longest) in sorted(stages.items(), key=lambda item: -item[1][1])])
+
+    blames = dict((item["args"]["file"], item["args"]) for item in profiler.stages if item["name"] == "blame")
+    files = sorted(profiler.get_file_times().items(), key=lambda item: -item[1][0])[:TOP]
+    if files:
+        shl.stderr("\nSlowest files:")
+        print_table(["File", "Plan", "Hunks", "Lines", "Git (s)", "Queued (s)"],
+                    *[[path, blames.get(path, {}).get("plan"), blames.get(path, {}).get("hunks"),
+                       blames.get(path, {}).get("lines"), "{:.3f}".format(git_time), "{:.3f}".format(wait)]
+                      for path, (git_time, wait) in files])
+
+        plans = {}
+        for args in blames.values():
+            plans[args.get("plan")] = plans.get(args.get("plan"), 0) + 1
+        shl.stderr("Blame plans: " + "  ".join("{plan}: {count}".format(plan=plan, count=count)
+                                               for plan, count in sorted(plans.items(), key=str)))
+
+    commands = sorted(profiler.commands, key=lambda command: command["start"] - command["end"])[:TOP]
+    if commands:
+        shl.stderr("\nSlowest git commands:")
+        print_table(["Command", "Status", "Bytes", "Time (s)"],
+                    *[[command["cmd"], command["status"], command["size"],
+                       "{:.3f}".format(command["end"] - command["start"])] for command in commands])
+    shl.stderr("")
+
+
+def write_trace(profiler, path):
+    with open(path, "w") as f:
+        json.dump(dict(traceEvents=profiler.get_trace_events(), displayTimeUnit="ms"), f)
@@ -0,0 +1,95 @@
+"""
+Compact records for the diff, hunk and blame data.  A big diff holds hundreds of thousands of
+these, so they use __slots__ rather than dicts, and convert to dicts only for output.
+"""
+from git_reviewers.authors import get_authors
+
+
+class Hunk(object):
+    """An old-side line range of a file's diff, the lines that get blamed"""
+    __slots__ = ("start_line", "num_lines")
+
+    def __init__(self, start_line, num_lines):
+        self.start_line = start_line
+        self.num_lines = num_lines
+
+    @property
+    def end_line(self):
+        return self.start_line + self.num_lines
+
+    def to_dict(self):
+        return dict(start_line=self.start_line, num_lines=self.num_lines)
+
+
+class BlameLine(object):
+    """A blamed line, its code is only kept when it is going to be shown"""
+    __slots__ = ("line_num", "commit", "code_line")
+
+    def __init__(self, line_num, commit, code_line=None):
+        self.line_num = line_num
+        self.commit = commit
+        self.code_line = code_line
+
+    def to_dict(self):
+        return dict(line_num=self.line_num, code_line=self.code_line, commit=self.commit)
+
+
+class FileDiff(object):
+    """A changed file from the raw diff, with its hunks and the blamed lines of each reviewer by author id"""
+    __slots__ = ("line", "context", "from_mode", "to_mode", "from_hash", "to_hash", "type_info", "type", "file",
+                 "to_file", "chunks", "reviewers", "commits", "blame_plan")
+
+    def __init__(self, line, context):
+        self.line = line
+        self.context = context
+        self.from_mode = self.to_mode = self.from_hash = self.to_hash = None
+        self.type_info = self.type = self.file = self.to_file = None
+        self.chunks = []
+        self.reviewers = {}
+        self.commits = {}
+        self.blame_plan = None
+
+    @property
+    def paths(self):
+        return (self.file,) if self.to_file is None else (self.file, self.to_file)
+
+    def add_line(self, reviewer, line):
+        if reviewer not in self.reviewers:
+            self.reviewers[reviewer] = []
+
+        self.reviewers[reviewer].append(line)
+
+    def has_code(self):
+        return all(line.code_line is not None for lines in self.reviewers.values() for line in lines)
+
+    def to_result(self):
+        """
+        The blamed results in the compact form the results cache stores.  Author ids only last
+        as long as the process, so the lines are stored by commit and regrouped when loaded.
+        """
+        return dict(chunks=[(chunk.start_line, chunk.num_lines) for chunk in self.chunks],
+                    lines=[(line.line_num, line.commit, line.code_line)
+                           for lines in self.reviewers.values() for line in lines],
+                    commits=self.commits,
+                    code=self.has_code())
+
+    def load_result(self, result):
+        self.chunks = [Hunk(start_line, num_lines) for start_line, num_lines in result["chunks"]]
+        self.commits = result["commits"]
+        self.reviewers = {}
+        author_ids = get_authors().get_commit_ids(self.commits)
+        for line in result["lines"]:
+            self.add_line(author_ids[line[1]], BlameLine(*line))
+
+    def to_dict(self):
+        diff_info = dict(line=self.line, parts=self.line.split("\t"), raw_info=self.line.split("\t")[0],
+                         chunks=[chunk.to_dict() for chunk in self.chunks],
+                         reviewers=dict((get_authors().get_name(reviewer), [line.to_dict() for line in lines])
+                                        for reviewer, lines in self.reviewers.items()),
+                         commits=self.commits, blame_plan=self.blame_plan)
+        if self.type:
+            diff_info.update(from_mode=self.from_mode, to_mode=self.to_mode, from_hash=self.from_hash,
+                             to_hash=self.to_hash, type_info=self.type_info, type=self.type, file=self.file)
+        if self.to_file is not None:
+            diff_info["to_file"] = self.to_file
+        return diff_info
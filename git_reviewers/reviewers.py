@@ -1,199 +1,986 @@
 #! /usr/bin/env python
+import asyncio
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+import copy
 from decimal import Decimal
-from os.path import abspath
+import os
+from os.path import abspath, relpath
 import pydoc
 import re
 import subprocess
 import sys
-
+import time
+
+from git_reviewers import budget, commands, planner, profile, sampling, scoring, shards
+from git_reviewers.authors import get_authors, open_authors
+from git_reviewers.cache import get_cache, open_cache, open_memory_cache
+from git_reviewers.commands import run_cmd_async, run_sync, stream_cmd_async
+from git_reviewers.index import build_index as build_ownership_index, get_index, open_index
+from git_reviewers.records import BlameLine, FileDiff, Hunk
 import python_lib.shell as shl
 
 
-def ensure_str(data):
-    if type(data) != str:
-        return data.decode("utf-8")
-    return data
-
-
-def run_cmd(cmd):
-    return ensure_str(subprocess.check_output(cmd.split(" "))).strip().split("\n")
+DEFAULT_CONTEXT = 3
 
 
-def get_git_branches():
+async def get_git_branches():
     cmd = "git branch"
-    return [x.strip() for x in run_cmd(cmd)]
+    return [x.strip() for x in await run_cmd_async(cmd)]
 
 
-def get_git_user():
+async def get_git_user():
     cmd = "git config --get user.name"
-    return run_cmd(cmd)[0]
+    return (await run_cmd_async(cmd))[0]
 
 
-def get_blame(filename, start, num_lines, branch):
-    cmd = "git --no-pager blame -L {start},+{num_lines} {branch} -- {file}"
-    cmd = cmd.format(start=start, num_lines=num_lines, branch=branch, file=filename)
-    return run_cmd(cmd)
+async def get_current_user():
+    try:
+        return await get_git_user()
+    except subprocess.CalledProcessError:
+        shl.warning("\nYou don't have git config `user.name` set, you may see yourself in the output.\n")
+        return None
+
 
+async def get_git_dir():
+    cmd = "git rev-parse --git-common-dir"
+    return abspath((await run_cmd_async(cmd))[0])
 
-def get_diff_raw(branch):
-    cmd = "git --no-pager diff --raw {branch}"
-    cmd = cmd.format(branch=branch)
-    return run_cmd(cmd)
 
+_toplevels = {}
 
-def get_file_diff(from_name, to_name, branch):
-    if to_name:
-        cmd = "git --no-pager diff {branch} -- {to_name} -- {from_name}"
-        cmd = cmd.format(branch=branch, from_name=from_name, to_name=to_name)
-    else:
-        cmd = "git --no-pager diff {branch} -- {file}"
-        cmd = cmd.format(branch=branch, file=from_name)
 
-    return run_cmd(cmd)
+async def get_toplevel():
+    cwd = os.getcwd()
+    if cwd not in _toplevels:
+        cmd = "git rev-parse --show-toplevel"
+        _toplevels[cwd] = (await run_cmd_async(cmd))[0]
+    return _toplevels[cwd]
 
 
-def read_diff_raw_line(line):
-    diff_info = dict(line=line, reviewers={}, chunks=[], parts=line.split("\t"))
-    diff_info["raw_info"] = diff_info["parts"][0]
-    if not diff_info["raw_info"]:
+async def get_commit(branch):
+    cmd = "git rev-parse --verify {branch}^{{commit}}"
+    cmd = cmd.format(branch=branch)
+    cat_file = commands.get_cat_file()
+    if cat_file:
+        found = await cat_file.get(branch + "^{commit}")
+        if not found:
+            raise subprocess.CalledProcessError(128, cmd.split(" "), b"", b"fatal: Needed a single revision")
+        return found[0]
+
+    return (await run_cmd_async(cmd))[0]
+
+
+async def get_merge_base(base, head):
+    cmd = "git merge-base {base} {head}"
+    cmd = cmd.format(base=base, head=head)
+    return (await run_cmd_async(cmd))[0]
+
+
+async def get_blame(filename, chunks, branch):
+    """
+    Blames all of the chunks of a file in one call by passing git a `-L` range per chunk, or
+    the whole file when chunks is None.  When `branch` is a commit sha the output can never
+    change, so it goes through the cache.
+    """
+    ranges = ["{start},+{num_lines}".format(start=chunk.start_line, num_lines=chunk.num_lines)
+              for chunk in chunks or []]
+
+    cache = get_cache() if SHA_RE.match(branch) else None
+    if cache:
+        blame = cache.get_blame(branch, filename, " ".join(ranges))
+        if blame is not None:
+            return blame
+
+    # Paths in the diff are relative to the top of the repository, not the working directory
+    cmd = ["git", "-C", await get_toplevel(), "--no-pager", "blame", "--porcelain"]
+    for line_range in ranges:
+        cmd += ["-L", line_range]
+    cmd += [branch, "--", filename]
+    blame = await run_cmd_async(cmd)
+
+    if cache:
+        cache.put_blame(branch, filename, " ".join(ranges), blame)
+
+    return blame
+
+
+async def get_file_lines(blob):
+    cat_file = commands.get_cat_file()
+    if cat_file:
+        found = await cat_file.get(blob)
+        if found:
+            return len(commands.split_output(found[2]))
+
+    cmd = "git cat-file blob {blob}"
+    cmd = cmd.format(blob=blob)
+    return len(await run_cmd_async(cmd))
+
+
+def get_diff_cmd(branch, paths=None, patch=True, context=DEFAULT_CONTEXT, head=None):
+    """The diff of the working tree against the branch, or of the head commit when given"""
+    cmd = ["git", "-c", "core.quotePath=true", "--no-pager", "diff", "--raw"] # Quoted the way unquote_path reads
+    if patch:
+        # The patches are matched to the raw lines by their headers, whatever diff.noprefix says
+        cmd += ["--patch", "-U{context}".format(context=context), "--src-prefix=a/", "--dst-prefix=b/"]
+    cmd.append(branch)
+    if head:
+        cmd.append(head)
+    if paths:
+        cmd += ["--"] + paths
+    return cmd
+
+
+async def get_diff(branch, paths=None, patch=True, context=DEFAULT_CONTEXT, head=None):
+    return await run_cmd_async(get_diff_cmd(branch, paths, patch, context, head))
+
+
+def stream_diff(branch, paths=None, patch=True, context=DEFAULT_CONTEXT, head=None):
+    return stream_cmd_async(get_diff_cmd(branch, paths, patch, context, head))
+
+
+PATHSPEC_BATCH = 256
+GLOB_RE = re.compile(r"[*?\[]")
+
+HUNK_HEADER_RE = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+\d+(?:,\d+)? @@")
+SHA_RE = re.compile(r"^[0-9a-f]{40}([0-9a-f]{24})?$")
+BLAME_HEADER_RE = re.compile(r"^([0-9a-f]{40,64}) \d+ (\d+)(?: \d+)?$")
+C_ESCAPES = {"a": 7, "b": 8, "t": 9, "n": 10, "v": 11, "f": 12, "r": 13, '"': 34, "\\": 92}
+C_QUOTES = dict((byte, char) for char, byte in C_ESCAPES.items())
+
+
+def unquote_path(path):
+    """A path as git gives it, unquoted if git quoted it for its special or non-ASCII characters"""
+    if not path.startswith('"'):
+        return path
+
+    data = bytearray()
+    idx = 1
+    while idx < len(path) - 1:
+        char = path[idx]
+        if char != "\\":
+            data += char.encode("utf-8", "surrogateescape")
+            idx += 1
+        elif path[idx + 1] in C_ESCAPES:
+            data.append(C_ESCAPES[path[idx + 1]])
+            idx += 2
+        else:
+            data.append(int(path[idx + 1:idx + 4], 8))
+            idx += 4
+    return data.decode("utf-8", "surrogateescape")
+
+
+def quote_path(path):
+    """The path quoted the way git quotes it with core.quotePath on"""
+    data = path.encode("utf-8", "surrogateescape")
+    if not any(byte < 0x20 or byte >= 0x7f or byte in C_QUOTES for byte in data):
+        return path
+
+    chars = []
+    for byte in data:
+        if byte in C_QUOTES:
+            chars.append("\\" + C_QUOTES[byte])
+        elif byte < 0x20 or byte >= 0x7f:
+            chars.append("\\{byte:03o}".format(byte=byte))
+        else:
+            chars.append(chr(byte))
+    return '"' + "".join(chars) + '"'
+
+
+def read_diff_raw_line(line, context=DEFAULT_CONTEXT):
+    diff_info = FileDiff(line, context)
+    parts = line.split("\t")
+    if not parts[0]:
         return diff_info
 
-    diff_info["from_mode"], \
-        diff_info["to_mode"], \
-        diff_info["from_hash"], \
-        diff_info["to_hash"], \
-        diff_info["type_info"] = diff_info["raw_info"].split(" ")
+    diff_info.from_mode, \
+        diff_info.to_mode, \
+        diff_info.from_hash, \
+        diff_info.to_hash, \
+        diff_info.type_info = parts[0].split(" ")
 
-    diff_info["type"] = diff_info["type_info"][0]
+    diff_info.type = diff_info.type_info[0]
 
-    diff_info["file"] = diff_info["parts"][1]
+    diff_info.file = unquote_path(parts[1])
 
-    if len(diff_info["parts"]) > 2:
-        diff_info["to_file"] = diff_info["parts"][2]
+    if len(parts) > 2:
+        diff_info.to_file = unquote_path(parts[2])
 
     return diff_info
 
 
-def get_code_chunks(diff_info, branch):
-    diff = get_file_diff(diff_info["file"], diff_info.get("to_file"), branch)
-
-    diff_info["chunks"] = []
+def get_patch_path(path, prefix):
+    """A path as the header of its patch has it, quoted by git"""
+    return quote_path(prefix + path)
+
+
+def get_patch_header(diff_info):
+    to_file = diff_info.file if diff_info.to_file is None else diff_info.to_file
+    return "diff --git {a} {b}".format(a=get_patch_path(diff_info.file, "a/"), b=get_patch_path(to_file, "b/"))
+
+
+def read_hunk_header(line):
+    match = HUNK_HEADER_RE.match(line)
+    if not match:
+        return None
+
+    return Hunk(int(match.group(1)), int(match.group(2) or 1))
+
+
+class DiffReader(object):
+    """
+    Incrementally parses the output of `git diff --raw --patch`.  The raw lines all come first,
+    followed by the patches in the same order, and each patch's hunk headers are attached as
+    chunks to the diff info whose paths its `diff --git` header has.  A raw line can have no
+    patch, such as an unmerged path, or two, as git splits a typechange into a deletion and a
+    creation.  Only the first, the deletion with the old lines, is read.  A diff info is done
+    once a later patch starts, or as soon as its raw line is read when there are no patches.
+    """
+    def __init__(self, patch=True, context=DEFAULT_CONTEXT):
+        self.patch = patch
+        self.context = context
+        self.diff_infos = []
+        self.patch_idx = -1
+        self.in_patch = False
+        self.num_done = 0
+
+    def find_patch(self, header):
+        """The index of the next diff info the patch header is for, None if it isn't for one"""
+        if self.patch_idx >= 0 and get_patch_header(self.diff_infos[self.patch_idx]) == header:
+            return None # The second patch of the last one
+        for idx in range(self.patch_idx + 1, len(self.diff_infos)):
+            if self.diff_infos[idx].type and get_patch_header(self.diff_infos[idx]) == header:
+                return idx
+        return None
+
+    def feed(self, line):
+        """Reads a line of the diff, returning the diff infos it completed"""
+        if line.startswith(":"):
+            self.diff_infos.append(read_diff_raw_line(line, self.context))
+            return [] if self.patch else self.pop_done(len(self.diff_infos))
+
+        if line.startswith("diff --git "):
+            idx = self.find_patch(line)
+            self.in_patch = idx is not None
+            if not self.in_patch:
+                return [] # The second half of a split typechange
+            self.patch_idx = idx
+            return self.pop_done(self.patch_idx)
+
+        if line.startswith("@@") and self.in_patch:
+            diff_info = self.diff_infos[self.patch_idx]
+            if diff_info.type == "A":
+                return [] # There are no old lines to blame in a new file
+            chunk = read_hunk_header(line)
+            if chunk:
+                diff_info.chunks.append(chunk)
+
+        return []
+
+    def close(self):
+        return self.pop_done(len(self.diff_infos))
+
+    def pop_done(self, end):
+        """Hands over the diff infos before `end`, dropping them so memory stays flat"""
+        done = self.diff_infos[self.num_done:end]
+        for idx in range(self.num_done, max(end, self.num_done)):
+            self.diff_infos[idx] = None
+        self.num_done = max(end, self.num_done)
+        return done
+
+
+def read_diff(diff, patch=True, context=DEFAULT_CONTEXT):
+    reader = DiffReader(patch, context)
+    diff_infos = []
     for line in diff:
-        if "@@" not in line:
+        diff_infos += reader.feed(line)
+    return diff_infos + reader.close()
+
+
+async def read_diff_stream(diff, patch=True, context=DEFAULT_CONTEXT):
+    """Like read_diff, but yields each diff info from the streamed diff as soon as it is done"""
+    reader = DiffReader(patch, context)
+    async for line in diff:
+        for diff_info in reader.feed(line):
+            yield diff_info
+    for diff_info in reader.close():
+        yield diff_info
+
+
+def read_blame_porcelain(blame, commits):
+    """
+    Parses `git blame --porcelain` output into (line_num, sha, code_line) records.  git only
+    prints a commit's author metadata the first time the commit appears, so it is read into
+    `commits` once and every later line just refers to the commit by its sha.
+    """
+    records = []
+    sha = line_num = None
+    for line in blame:
+        if line.startswith("\t"):
+            records.append((line_num, sha, line[1:]))
+            sha = None
+            continue
+
+        match = BLAME_HEADER_RE.match(line)
+        if match:
+            if sha:
+                records.append((line_num, sha, "")) # Trailing whitespace is stripped from the output
+            sha, line_num = match.group(1), int(match.group(2))
+            if sha not in commits:
+                commits[sha] = dict(sha=sha, author=None, email=None, time=None)
+            sha = commits[sha]["sha"] # Share one sha string between all of the commit's lines
             continue
 
-        line_chunk = line.split("@@")[1].split(" ")[1][1:]
-        splits = line_chunk.split(",")
-        if len(splits) != 2:
+        if not sha:
             continue
 
-        chunk = dict(start_line=splits[0], num_lines=splits[1])
+        key, _, value = line.partition(" ")
+        if key == "author":
+            commits[sha]["author"] = sys.intern(value)
+        elif key == "author-mail":
+            commits[sha]["email"] = value.strip("<>")
+        elif key == "author-time":
+            commits[sha]["time"] = int(value)
+
+    if sha:
+        records.append((line_num, sha, ""))
+
+    return records
+
+
+def merge_hunks(chunks):
+    """
+    Merges overlapping and touching hunks into sorted, disjoint ranges so each line is blamed
+    once.  A pure insertion has no old lines, so it stands for the line it was inserted after.
+    """
+    merged = []
+    for chunk in sorted(chunks, key=lambda chunk: chunk.start_line):
+        start_line, end_line = chunk.start_line, chunk.end_line
+        if not chunk.num_lines:
+            if not start_line:
+                continue # Inserted at the top of an empty file
+            end_line = start_line + 1
+
+        if merged and start_line <= merged[-1].end_line:
+            merged[-1].num_lines = max(merged[-1].end_line, end_line) - merged[-1].start_line
+        else:
+            merged.append(Hunk(start_line, end_line - start_line))
+
+    return merged
+
+
+def get_changed_lines(diff_info):
+    """The number of lines around a file's changes that blame looks at"""
+    return sum(chunk.num_lines for chunk in merge_hunks(diff_info.chunks))
+
 
-        diff_info["chunks"].append(chunk)
+def check_deadline(deadline):
+    if deadline is not None and time.monotonic() >= deadline:
+        raise budget.DeadlineExceeded()
+
+
+async def get_blame_data(diff_info, branch, keep_code=True, deadline=None):
+    """
+    Blames the lines around the file's hunks into its reviewers.  Raises DeadlineExceeded,
+    rather than starting another git command, once the `time.monotonic()` deadline has passed.
+    """
+    chunks = merge_hunks(diff_info.chunks)
+    if not chunks:
+        return diff_info
+
+    index = get_index()
+    records = None
+    if index:
+        with profile.stage("index", file=diff_info.file):
+            records = index.query(branch, diff_info.file, chunks, diff_info.commits)
+    if records is None:
+        check_deadline(deadline) # Before the planner looks up the file's length
+    if records is not None:
+        diff_info.blame_plan = "index"
+    elif planner.may_blame_whole_file(chunks) and \
+            planner.should_blame_whole_file(chunks, await get_file_lines(diff_info.from_hash)):
+        diff_info.blame_plan = "file"
+        check_deadline(deadline)
+        blame = await get_blame(diff_info.file, None, branch)
+        with profile.stage("parse", file=diff_info.file):
+            records = planner.slice_records(read_blame_porcelain(blame, diff_info.commits), chunks)
+    else:
+        diff_info.blame_plan = "ranges"
+        blame = await get_blame(diff_info.file, chunks, branch)
+        with profile.stage("parse", file=diff_info.file):
+            records = read_blame_porcelain(blame, diff_info.commits)
+
+    author_ids = get_authors().get_commit_ids(diff_info.commits)
+    for line_num, sha, code_line in records:
+        diff_info.add_line(author_ids[sha], BlameLine(line_num, sha, code_line if keep_code else None))
 
     return diff_info
 
 
-def get_blame_code_line(line):
-    prefix, code_line = line.split(")", 1)
-    _, _, line_num = prefix.rpartition(" ")
-    return dict(line_num=line_num, code_line=code_line[1:])
+def get_result_key(diff_info, branch):
+    """The key a file's results are stored under, None if its contents aren't pinned to blobs"""
+    if not SHA_RE.match(branch) or diff_info.type in ("A", None):
+        return None
+    if not diff_info.to_hash.strip("0"):
+        return None # Uncommitted changes in the working tree, there's no blob to key on
 
+    return (branch, diff_info.from_hash, diff_info.to_hash, "\t".join(diff_info.paths), diff_info.context)
 
-def get_blame_reviewer(line):
-    reviewer_name_parts = []
-    reviewer_parts = line.split("(")[1].split(")")[0].split(" ")
-    for part in reviewer_parts:
-        if re.match("^[0-9]{4}\-[0-9]{1,2}\-[0-9]{1,2}$", part):
-            break
-        reviewer_name_parts.append(part.strip())
-    return " ".join(reviewer_name_parts).strip()
 
+def restore_file_reviewers(diff_info, branch, keep_code=True):
+    cache = get_cache()
+    key = get_result_key(diff_info, branch)
+    if not cache or not key:
+        return False
 
-def get_blame_data(diff_info, branch):
-    for chunk in diff_info["chunks"]:
-        blame_info = get_blame(diff_info["file"], chunk["start_line"], chunk["num_lines"], branch)
+    result = cache.get_result(*key)
+    if result is None or (keep_code and not result["code"]):
+        return False
 
-        for line in blame_info:
-            if "(" not in line or ")" not in line:
-                continue
+    diff_info.load_result(result)
+    return True
 
-            code_line = get_blame_code_line(line)
-            reviewer = get_blame_reviewer(line)
 
-            if reviewer not in diff_info["reviewers"]:
-                diff_info["reviewers"][reviewer] = []
+def store_file_reviewers(diff_info, branch):
+    cache = get_cache()
+    key = get_result_key(diff_info, branch)
+    if not cache or not key:
+        return
 
-            diff_info["reviewers"][reviewer].append(code_line)
+    cache.put_result(*key + (diff_info.to_result(),))
 
-    return diff_info
 
+def get_pathspecs(files):
+    """Turns the file arguments into pathspecs, patterns like `src/**/*.py` need git's glob magic"""
+    return [path if path.startswith(":") or not GLOB_RE.search(path) else ":(glob)" + path
+            for path in files]
+
+
+def get_top_pathspecs(paths):
+    """Pathspecs matching exactly the given paths from the top of the repository"""
+    return [":(top,literal)" + path for path in paths]
+
+
+async def get_file_matcher(files):
+    """
+    Gets a function matching diff infos against the file arguments when there are too many to
+    pass to git on the command line.  Returns None when git can filter them itself.
+    """
+    if len(files) <= PATHSPEC_BATCH or any(path.startswith(":") or GLOB_RE.search(path) for path in files):
+        return None
+
+    toplevel = await get_toplevel()
+    paths = set(relpath(abspath(path), toplevel) for path in files)
+
+    def matches_path(path):
+        while path:
+            if path in paths:
+                return True
+            path = path.rpartition("/")[0]
+        return False
+
+    return lambda diff_info: any(matches_path(path) for path in diff_info.paths)
+
+
+async def patch_diff_infos(branch, diff_infos, context=DEFAULT_CONTEXT, head=None):
+    """Fills in the chunks of diff infos read without patches, with one diff of just their paths"""
+    paths = get_top_pathspecs(path for diff_info in diff_infos for path in diff_info.paths)
+    patched = dict((patched_info.paths, patched_info)
+                   for patched_info in read_diff(await get_diff(branch, paths, context=context, head=head),
+                                                 context=context))
+    for diff_info in diff_infos:
+        patched_info = patched.get(diff_info.paths)
+        if patched_info:
+            diff_info.chunks = patched_info.chunks
+
+
+async def read_branch_diff(branch, files=None, keep_code=True, context=DEFAULT_CONTEXT, head=None, deadline=None,
+                           unpatched=None):
+    """
+    Streams the diff infos for the branch with their chunks as (diff_info, restored) pairs,
+    restoring the results of files whose blob pair is unchanged since a previous run.  Only the
+    files that weren't restored are diffed for their patches, in batches.  Restored files are
+    passed on right away, unless a file before them is still waiting for its patch.  The diff
+    is limited to the given files, by git wherever it can.  Hunks get `context` lines around
+    the changes.  Once the `time.monotonic()` deadline passes no more batches are diffed, and
+    their files are added to `unpatched` instead of being passed on.
+    """
+    matcher = await get_file_matcher(files) if files else None
+    pathspecs = get_pathspecs(files) if files and not matcher else None
+    cache = get_cache()
+
+    pending = []
+    stale = []
+
+    async def patch_pending():
+        if deadline is None or time.monotonic() < deadline:
+            await patch_diff_infos(branch, stale, context, head)
+            return pending
+        if unpatched is not None:
+            unpatched.extend(stale)
+        stale_ids = set(id(diff_info) for diff_info in stale)
+        return [(diff_info, restored) for diff_info, restored in pending if id(diff_info) not in stale_ids]
+
+    diff = stream_diff(branch, pathspecs, not cache, context, head)
+    async for diff_info in read_diff_stream(diff, not cache, context):
+        if matcher and not matcher(diff_info):
+            continue
+        if not cache:
+            yield diff_info, False
+            continue
+
+        with profile.stage("restore", file=diff_info.file):
+            restored = restore_file_reviewers(diff_info, branch, keep_code)
+        if not restored and diff_info.type not in ("A", None):
+            stale.append(diff_info)
+        elif not stale:
+            yield diff_info, restored # Nothing before it is waiting
+            continue
+        pending.append((diff_info, restored))
+
+        if len(stale) >= PATHSPEC_BATCH:
+            for item in await patch_pending():
+                yield item
+            pending, stale = [], []
 
-def get_file_reviewers(line, branch):
+    for item in (await patch_pending() if stale else pending):
+        yield item
 
-    diff_info = read_diff_raw_line(line)
-    if diff_info.get("type") in ("A", None):
+
+async def get_file_reviewers(diff_info, branch, keep_code=True, store=True, deadline=None):
+    if diff_info.type in ("A", None):
         return diff_info # Do not get reviewers on a new file
 
-    diff_info = get_code_chunks(diff_info, branch)
+    profile.set_file(diff_info.file)
+    with profile.stage("blame", file=diff_info.file, hunks=len(diff_info.chunks)) as args:
+        diff_info = await get_blame_data(diff_info, branch, keep_code, deadline)
+        args.update(plan=diff_info.blame_plan, lines=sum(len(lines) for lines in diff_info.reviewers.values()))
 
-    diff_info = get_blame_data(diff_info, branch)
+    if store:
+        store_file_reviewers(diff_info, branch)
 
     return diff_info
 
 
-def get_total_reviewers(diff_infos):
-    total_reviewers = {}
+async def get_files_reviewers(diff_infos, branch, keep_code=True):
+    """
+    Blames the files concurrently as they stream in as (diff_info, restored) pairs, yielding the
+    results in diff order.  The number of git processes running at once is bounded by
+    `commands.MAX_JOBS`.  Restored files already have their results and are passed straight through.
+    The queue is bounded, so only a few files are read ahead of the one being waited for.
+    """
+    queue = asyncio.Queue(maxsize=commands.MAX_JOBS * 2)
+    tasks = set()
+
+    async def start_blames():
+        try:
+            async for diff_info, restored in diff_infos:
+                task = None if restored else asyncio.ensure_future(get_file_reviewers(diff_info, branch, keep_code))
+                if task:
+                    tasks.add(task)
+                await queue.put((diff_info, task))
+        finally:
+            await queue.put(None)
+
+    producer = asyncio.ensure_future(start_blames())
     try:
-        current_user = get_git_user()
-    except subprocess.CalledProcessError:
-        shl.warning("\nYou don't have git config `user.name` set, you may see yourself in the output.\n")
-        current_user = None
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+
+            diff_info, task = item
+            if task:
+                diff_info = await task
+                tasks.discard(task)
+            yield diff_info
+
+        await producer # Raises anything that went wrong reading the diff
+    finally:
+        producer.cancel()
+        for task in tasks:
+            task.cancel()
+
+
+async def prepare_branch(branch):
+    """
+    Resolves the branch to the commit to blame at, so the results can be cached, and readies
+    what every blame of it shares: the author table, resolved once here rather than by every
+    blame started at once, and the files the index can answer.  Returns the commit.
+    """
+    branch = await get_commit(branch)
+    await open_authors(await get_toplevel())
+    if get_index():
+        await get_index().prepare(branch)
+    return branch
+
+
+async def iter_diff_infos(branch, files=None, keep_code=True, context=DEFAULT_CONTEXT, head=None):
+    """
+    Streams the blamed diff infos for the branch, optionally restricted to the given files,
+    which may be paths or git pathspecs such as `src/**/*.py` or `:!vendor`.  The code of the
+    blamed lines is only kept with `keep_code`.  The lines blamed are the old side of each hunk
+    with `context` lines around the changes.  The changes are those of the working tree, or of
+    the `head` commit when given.  This is the entry point for callers that are already running
+    an event loop.
+    """
+    branch = await prepare_branch(branch)
+
+    diff_infos = read_branch_diff(branch, files, keep_code, context, head)
+    async for diff_info in get_files_reviewers(diff_infos, branch, keep_code):
+        if diff_info.type:
+            yield diff_info
+
+
+async def get_diff_infos(branch, files=None, on_diff_info=None, keep_code=True, context=DEFAULT_CONTEXT, head=None):
+    """Gets all of the blamed diff infos from `iter_diff_infos`, calling on_diff_info with each one"""
+    diff_infos = []
+    async for diff_info in iter_diff_infos(branch, files, keep_code, context, head):
+        diff_infos.append(diff_info)
+        if on_diff_info:
+            on_diff_info(diff_info)
 
-    for diff_info in diff_infos:
-        for reviewer in diff_info["reviewers"]:
-            if current_user and current_user.strip() == reviewer:
-                continue # Don't include the current user
+    return diff_infos
 
-            if reviewer not in total_reviewers:
-                total_reviewers[reviewer] = 0
 
-            total_reviewers[reviewer] += len(diff_info["reviewers"][reviewer])
+async def stream_reviewers(branch, files=None, diff_infos=None, on_diff_info=None, keep_code=True,
+                           context=DEFAULT_CONTEXT, head=None, columns=None):
+    """
+    Streams the diff through blame into running reviewer line totals, calling on_diff_info with
+    each file as it is done.  Returns the number of files and the totals.  The diff infos are
+    only kept, in `diff_infos`, when it is given, the totals just need their line counts.  The
+    blame is collected into `columns` for scoring when it is given.
+    """
+    total_reviewers = {}
+    num_files = 0
+    async for diff_info in iter_diff_infos(branch, files, keep_code, context, head):
+        num_files += 1
+        if on_diff_info:
+            on_diff_info(diff_info)
+        count_reviewer_lines(total_reviewers, diff_info)
+        if diff_infos is not None:
+            diff_infos.append(diff_info)
+        if columns is not None:
+            columns.add_diff_info(diff_info)
+
+    return num_files, total_reviewers
+
+
+async def blame_in_order(branch, diff_infos, on_blamed, deadline=None, stop=None, store=True):
+    """
+    Blames the files in the order given, keeping `commands.MAX_JOBS` blames running, and calls
+    on_blamed with each one as it is done.  Once the `time.monotonic()` deadline passes, or
+    stop() is true, no more blames are started and those still running are cancelled, as are
+    those that reach a git command after the deadline.  Returns the files that weren't
+    blamed.  Their results are only cached with `store`, when they are of all of the files'
+    hunks.
+    """
+    pending = list(reversed(diff_infos))
+    running = {}
+    skipped = []
+    try:
+        while pending or running:
+            if stop and stop():
+                break
+            while pending and len(running) < commands.MAX_JOBS and (deadline is None or time.monotonic() < deadline):
+                diff_info = pending.pop()
+                running[asyncio.ensure_future(get_file_reviewers(diff_info, branch, False, store, deadline))] = diff_info
+            if not running:
+                break
+
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                diff_info = running.pop(task)
+                try:
+                    on_blamed(task.result())
+                except budget.DeadlineExceeded:
+                    skipped.append(diff_info)
+            if not done:
+                break # Out of time
+    finally:
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True) # Kills their git processes
+
+    return skipped + list(running.values()) + list(reversed(pending))
+
+
+async def stream_anytime_reviewers(branch, files=None, on_diff_info=None, context=DEFAULT_CONTEXT, columns=None,
+                                   deadline=None, top=None):
+    """
+    Like stream_reviewers, but reads the whole diff first and blames the files with the most
+    changed lines first, stopping at the `time.monotonic()` deadline, or once the `top`
+    reviewers other than the current user can't change.  Files restored from the cache are
+    counted right away, and files still to be diffed for their patches at the deadline are
+    skipped.  Returns the number of files, the totals of the files that were
+    blamed, and their coverage of the changed lines.
+    """
+    branch = await prepare_branch(branch)
+    current_user = await get_current_user() if top else None
 
-    total_reviewers_list = zip(total_reviewers.keys(), total_reviewers.values())
-    total_reviewers_list = [list(x) for x in total_reviewers_list]
-    total_reviewers_list = sorted(total_reviewers_list, key=lambda k: k[1], reverse=True)
+    total_reviewers = {}
+    coverage = budget.Coverage()
+    num_files = 0
+
+    def count_diff_info(diff_info):
+        if on_diff_info:
+            on_diff_info(diff_info)
+        count_reviewer_lines(total_reviewers, diff_info)
+        if columns is not None:
+            columns.add_diff_info(diff_info)
+        coverage.add_blamed(get_changed_lines(diff_info))
+
+    queued = []
+    unpatched = []
+    async for diff_info, restored in read_branch_diff(branch, files, False, context, deadline=deadline,
+                                                      unpatched=unpatched):
+        if not diff_info.type:
+            continue
+        num_files += 1
+        coverage.add_changed(get_changed_lines(diff_info))
+        if restored or diff_info.type == "A":
+            count_diff_info(diff_info)
+        else:
+            queued.append(diff_info)
+
+    def is_top_settled():
+        current_id = get_authors().find(current_user.strip()) if current_user else None
+        coverage.settled = budget.is_top_settled(
+            [lines for reviewer, lines in total_reviewers.items() if reviewer != current_id], top,
+            coverage.remaining_lines)
+        return coverage.settled
+
+    # The changed lines of unpatched files aren't known, so nothing can be settled with them
+    skipped = await blame_in_order(branch, budget.order_by_lines(queued, get_changed_lines), count_diff_info, deadline,
+                                   is_top_settled if top and not unpatched else None)
+    for diff_info in skipped:
+        coverage.add_skipped(len(diff_info.chunks))
+    num_files += len(unpatched)
+    for diff_info in unpatched:
+        coverage.add_skipped(0) # Their hunks were never read
+
+    return num_files, total_reviewers, coverage
+
+
+async def stream_sampled_reviewers(branch, files=None, on_diff_info=None, context=DEFAULT_CONTEXT, size=1000,
+                                   seed=sampling.DEFAULT_SEED):
+    """
+    Estimates the reviewers of a giant diff by blaming a stratified sample of `size` of its
+    hunks, drawn with the seed.  Files restored from the cache are counted exactly.  Returns
+    the number of files, each reviewer's (lines, share, error) estimate and the sample.
+    """
+    branch = await prepare_branch(branch)
+    current_user = await get_current_user()
+
+    exact = {}
+    hunks = []
+    num_files = 0
+    async for diff_info, restored in read_branch_diff(branch, files, False, context):
+        if not diff_info.type:
+            continue
+        num_files += 1
+        if restored or diff_info.type == "A":
+            if on_diff_info:
+                on_diff_info(diff_info)
+            count_reviewer_lines(exact, diff_info)
+        else:
+            hunks += [(diff_info, hunk) for hunk in merge_hunks(diff_info.chunks)]
+
+    sample = sampling.HunkSample([(diff_info.file, hunk.num_lines) for diff_info, hunk in hunks], size, seed)
+    sampled_infos = {}
+    hunk_idxs = {} # The sample's index of each of a sampled file's hunks, in line order
+    for idx in sample.get_sampled():
+        diff_info, hunk = hunks[idx]
+        if diff_info not in sampled_infos:
+            sampled_info = sampled_infos[diff_info] = copy.copy(diff_info) # Blamed for just the sampled hunks
+            sampled_info.chunks, sampled_info.reviewers, sampled_info.commits = [], {}, {}
+            hunk_idxs[sampled_info] = []
+        sampled_infos[diff_info].chunks.append(hunk)
+        hunk_idxs[sampled_infos[diff_info]].append(idx)
+
+    hunk_lines = {}
+
+    def count_sampled(sampled_info):
+        if on_diff_info:
+            on_diff_info(sampled_info)
+        starts = [hunk.start_line for hunk in sampled_info.chunks]
+        for reviewer, lines in sampled_info.reviewers.items():
+            for line in lines:
+                idx = hunk_idxs[sampled_info][bisect_right(starts, line.line_num) - 1]
+                counts = hunk_lines.setdefault(idx, {})
+                counts[reviewer] = counts.get(reviewer, 0) + 1
+
+    # Not cached, the results of a file are only of its sampled hunks
+    await blame_in_order(branch, budget.order_by_lines(list(sampled_infos.values()), get_changed_lines), count_sampled,
+                         store=False)
+
+    exclude = get_authors().find(current_user.strip()) if current_user else None
+    return num_files, sample.estimate(hunk_lines, exact, exclude), sample
+
+
+async def tally_shard(branch, diff_infos, columns=None):
+    branch = await prepare_branch(branch)
+
+    async def restore_diff_infos():
+        for diff_info in diff_infos:
+            yield diff_info, restore_file_reviewers(diff_info, branch, False)
 
-    total_lines = sum(reviewer[1] for reviewer in total_reviewers_list)
+    total_reviewers = {}
+    async for diff_info in get_files_reviewers(restore_diff_infos(), branch, False):
+        count_reviewer_lines(total_reviewers, diff_info)
+        if columns is not None:
+            columns.add_diff_info(diff_info)
+
+    return total_reviewers, columns, get_authors().get_identities()
+
+
+def blame_shard(branch, git_dir, diff_infos, use_cache=True, jobs=None, timeout=None, whole_file_threshold=None,
+                collect_columns=False):
+    """
+    Blames a shard of the diff in a worker process and returns its reviewer line tally, its
+    blame columns when they are collected, and the identities of its author ids
+    """
+    commands.configure(jobs, timeout)
+    planner.configure(whole_file_threshold)
+    cache = open_cache(git_dir) if use_cache else None
+    open_index(git_dir)
+    try:
+        return run_sync(tally_shard(branch, diff_infos, scoring.BlameColumns() if collect_columns else None))
+    finally:
+        if cache:
+            cache.close()
+
+
+async def read_diff_infos(branch, files=None, context=DEFAULT_CONTEXT):
+    return [diff_info async for diff_info, _ in read_branch_diff(branch, files, False, context) if diff_info.type]
+
+
+def shard_reviewers(branch, files=None, processes=2, on_diff_info=None, use_cache=True, context=DEFAULT_CONTEXT,
+                    whole_file_threshold=None, columns=None):
+    """
+    Like stream_reviewers, but shards the changed files by directory across worker processes
+    for diffs big enough that parsing and counting in one process is the bottleneck.  The diff
+    is read here, each worker blames its shard with its own cache connection and share of the
+    jobs, and their tallies are merged, and their blame columns into `columns` when it is given.
+    Returns the number of files and the totals.
+    """
+    git_dir = run_sync(get_git_dir())
+    branch = run_sync(get_commit(branch))
+    authors = run_sync(open_authors(run_sync(get_toplevel())))
+    diff_infos = run_sync(read_diff_infos(branch, files, context))
+    if on_diff_info:
+        for diff_info in diff_infos:
+            on_diff_info(diff_info)
+
+    jobs = -(-commands.MAX_JOBS // processes)
+    blamed = [diff_info for diff_info in diff_infos if diff_info.type not in ("A", None)]
+    with ProcessPoolExecutor(processes) as executor:
+        futures = [executor.submit(blame_shard, branch, git_dir, shard, use_cache, jobs, commands.TIMEOUT,
+                                   planner.WHOLE_FILE_THRESHOLD, columns is not None)
+                   for shard in shards.shard_diff_infos(blamed, processes)]
+        results = [future.result() for future in futures]
+
+    tallies = []
+    for tally, shard_columns, identities in results:
+        author_ids = [authors.add(name, email) for name, email in identities]
+        tallies.append(dict((author_ids[author_id], lines) for author_id, lines in tally.items()))
+        if columns is not None:
+            columns.extend(shard_columns, author_ids)
+    return len(diff_infos), shards.merge_tallies(tallies)
+
+
+def count_reviewer_lines(total_reviewers, diff_info):
+    for reviewer, lines in diff_info.reviewers.items():
+        if reviewer not in total_reviewers:
+            total_reviewers[reviewer] = 0
+
+        total_reviewers[reviewer] += len(lines)
+
+
+def rank_reviewers(total_reviewers, current_user, scores=None):
+    """
+    Ranks the reviewers as [name, lines, percent] by their share of the lines, or of the scores
+    when given, such as those of a `scoring` strategy.  Both are keyed by author id.
+    """
+    scores = scores or total_reviewers
+    authors = get_authors()
+    current_id = authors.find(current_user.strip()) if current_user else None
+    total_reviewers_list = [[reviewer, lines] for reviewer, lines in total_reviewers.items()
+                            if reviewer != current_id] # Don't include the current user
+    total_reviewers_list = sorted(total_reviewers_list, key=lambda k: scores.get(k[0], 0), reverse=True)
+
+    total_score = Decimal(sum(scores.get(reviewer[0], 0) for reviewer in total_reviewers_list))
     for reviewer in total_reviewers_list:
-        reviewer.append(round((Decimal(reviewer[1]) / total_lines) * 100, 2))
+        reviewer.append(round((Decimal(scores.get(reviewer[0], 0)) / total_score) * 100, 2))
+        reviewer[0] = authors.get_name(reviewer[0])
 
     return total_reviewers_list
 
 
-def print_suggested_reviewers(diff_infos):
-    total_reviewers = get_total_reviewers(diff_infos)
+def rank_estimates(estimates):
+    """Ranks the reviewers as [name, lines, percent, error] by their estimated share of the lines"""
+    authors = get_authors()
+    ranked = [[authors.get_name(reviewer), int(round(lines)), round(Decimal(share) * 100, 2),
+               round(Decimal(error) * 100, 2)] for reviewer, (lines, share, error) in estimates.items()]
+    return sorted(ranked, key=lambda k: k[2], reverse=True)
+
+
+def get_total_reviewers(diff_infos, current_user):
+    total_reviewers = {}
+    for diff_info in diff_infos:
+        count_reviewer_lines(total_reviewers, diff_info)
+
+    return rank_reviewers(total_reviewers, current_user)
+
 
+def print_suggested_reviewers(total_reviewers, coverage=None, sample=None):
+    partial = coverage is not None and coverage.partial
     if not total_reviewers:
-        shl.print_color(shl.BOLD, "\nNo potential reviewers found. This may be because the only person to work on this was you.\n")
+        if partial:
+            shl.print_color(shl.BOLD, "\nNo potential reviewers found in the {blamed} of {changed} changed lines "
+                            "blamed in time, {files} files were not blamed in time.\n".format(
+                                blamed=coverage.blamed_lines, changed=coverage.changed_lines,
+                                files=coverage.skipped_files))
+        else:
+            shl.print_color(shl.BOLD, "\nNo potential reviewers found. This may be because the only person to work on this was you.\n")
         sys.exit(2)
 
-    shl.print_section(shl.BOLD, "Suggested Reviewers:")
+    if partial and coverage.settled:
+        shl.print_section(shl.BOLD, "Suggested Reviewers:")
+        shl.stdout("The top reviewers were settled after {blamed} of {changed} changed lines ({percent:.1f}%), "
+                   "skipping {hunks} hunks in {files} files\n".format(
+                       blamed=coverage.blamed_lines, changed=coverage.changed_lines, percent=coverage.ratio * 100,
+                       hunks=coverage.skipped_hunks, files=coverage.skipped_files))
+    elif sample:
+        shl.print_section(shl.BOLD, "Suggested Reviewers (ESTIMATED):")
+        shl.stdout("Estimated from {sampled_hunks} of {hunks} hunks ({sampled_lines} of {changed_lines} changed lines) "
+                   "in {strata} directories with seed {seed}, to 95% confidence\n".format(**sample.to_dict()))
+    elif partial:
+        shl.print_section(shl.BOLD, "Suggested Reviewers (PARTIAL):")
+        shl.stdout("Based on {blamed} of {changed} changed lines ({percent:.1f}%), {files} files were not blamed in "
+                   "time\n".format(blamed=coverage.blamed_lines, changed=coverage.changed_lines,
+                                   percent=coverage.ratio * 100, files=coverage.skipped_files))
+    else:
+        shl.print_section(shl.BOLD, "Suggested Reviewers:")
 
     # shl.print_table(["User", "Contributed", "Number of Lines"], total_reviewers)
     for reviewer in total_reviewers:
-        shl.stdout("{user: >30}\t\t\t(Contrib: {percent: >5}%   Lines: {lines})".format(user=reviewer[0], percent=reviewer[2], lines=reviewer[1]))
+        percent = "{percent: >5}%".format(percent=reviewer[2])
+        if len(reviewer) > 3:
+            percent += " ± {error}%".format(error=reviewer[3]) # Estimated from a sample
+        shl.stdout("{user: >30}\t\t\t(Contrib: {percent}   Lines: {lines})".format(user=reviewer[0], percent=percent, lines=reviewer[1]))
     shl.stdout()
 
 
 def print_contributer_lines(contributer, diff_infos):
     output = []
     for diff_info in diff_infos:
-        lines = diff_info["reviewers"].get(contributer)
+        lines = diff_info.reviewers.get(get_authors().find(contributer))
         if not lines:
             continue
 
-        shl.print_section(shl.BOLD, diff_info["from_hash"], diff_info["file"], file=output)
+        shl.print_section(shl.BOLD, diff_info.from_hash, diff_info.file, file=output)
 
         prev_line = None
         for line in lines:
@@ -202,17 +989,17 @@ def print_contributer_lines(contributer, diff_infos):
                 from pygments.lexers import PythonLexer
                 from pygments.formatters import TerminalFormatter
 
-                code = highlight(line["code_line"], PythonLexer(), TerminalFormatter())
+                code = highlight(line.code_line, PythonLexer(), TerminalFormatter())
             except ImportError:
-                code = line["code_line"]
+                code = line.code_line
 
-            cur_line = int(line["line_num"])
+            cur_line = line.line_num
 
             if prev_line and prev_line + 1 < cur_line:
                 output.append("    .")
                 output.append("    .")
                 output.append("    .")
-            output.append("{line_num: >5}|\t{code_line}".format(line_num=line["line_num"], code_line=code.rstrip()))
+            output.append("{line_num: >5}|\t{code_line}".format(line_num=line.line_num, code_line=code.rstrip()))
 
             prev_line = cur_line
 
@@ -221,41 +1008,216 @@ def print_contributer_lines(contributer, diff_infos):
     pydoc.pager("\n".join(output))
 
 
-def get_reviewers(contributor, branch, files, output):
-    raw = get_diff_raw(branch)
+def print_diff_info(diff_info):
+    if diff_info.type == "A":
+        shl.print_color(shl.GREEN, diff_info.line)
+    elif diff_info.type == "D":
+        shl.print_color(shl.RED, diff_info.line)
+    elif diff_info.type == "M":
+        shl.print_color(shl.YELLOW, diff_info.line)
+    else:
+        shl.print_color(shl.LTBLUE, diff_info.line)
+
+
+def write_ndjson(record):
+    """Writes a record as one compact line of JSON, flushed so consumers can read it right away"""
+    shl.write_json((record,), raw=True, end="\n", flush=True)
+
+
+def write_file_record(diff_info):
+    print_diff_info(diff_info)
+    write_ndjson(dict(diff_info.to_dict(), record="file"))
+
+
+def get_reviewer_records(total_reviewers):
+    records = []
+    for reviewer in total_reviewers:
+        records.append(dict(user=reviewer[0], lines=reviewer[1], percent=reviewer[2]))
+        if len(reviewer) > 3:
+            records[-1]["error"] = reviewer[3]
+    return records
+
+
+def write_summary_record(num_files, total_reviewers, strategy="lines", scores=None, coverage=None, sample=None):
+    record = dict(record="summary", files=num_files, reviewers=get_reviewer_records(total_reviewers), score=strategy)
+    if coverage is not None:
+        record.update(coverage.to_dict())
+    if sample is not None:
+        record["sample"] = sample.to_dict()
+    if scores:
+        authors = get_authors()
+        record["scores"] = dict((strategy, dict((authors.get_name(author_id), score)
+                                                for author_id, score in by_author.items()))
+                                for strategy, by_author in scores.items())
+    write_ndjson(record)
+
+
+def print_cache_stats(cache):
+    stats = cache.stats()
+    shl.print_section(shl.BOLD, "Blame Cache:")
+    shl.stderr("{path}\n\thits: {hits}  misses: {misses}  evictions: {evictions}\n"
+               "\tfile results reused: {result_hits}  recomputed: {result_misses}\n"
+               "\tentries: {entries}  size: {size} / {max_size} bytes".format(**stats))
+
+
+def build_index(branch, jobs=None, timeout=None):
+    commands.configure(jobs, timeout)
+    run_sync(build_ownership_index(run_sync(get_git_dir()), run_sync(get_commit(branch)), run_sync(get_toplevel())))
+
+
+def print_profile(profiler, trace=None):
+    profiler.stop()
+    profile.print_summary(profiler)
+    if trace:
+        profile.write_trace(profiler, trace)
+        shl.stderr("Wrote the trace events to {trace}\n", trace=trace)
+
+
+async def get_pair_reviewers(head, base, current_user=None, context=DEFAULT_CONTEXT, files=None):
+    """
+    Gets the suggested reviewers of a head commit's changes since its merge base with the base,
+    the changes a pull request of head into base shows, as a "pair" record.
+    """
+    head_commit = await get_commit(head)
+    merge_base = await get_merge_base(base, head_commit)
+    num_files, total_reviewers = await stream_reviewers(merge_base, files, keep_code=False, context=context,
+                                                        head=head_commit)
+    return dict(record="pair", head=head, base=base, head_commit=head_commit, merge_base=merge_base, files=num_files,
+                reviewers=get_reviewer_records(rank_reviewers(total_reviewers, current_user)))
+
+
+async def write_batch_records(pairs, context=DEFAULT_CONTEXT):
+    current_user = await get_current_user()
+    for head, base in pairs:
+        try:
+            record = await get_pair_reviewers(head, base, current_user, context)
+        except subprocess.CalledProcessError as e:
+            record = dict(record="pair", head=head, base=base,
+                          error="{cmd} failed: {stderr}".format(cmd=" ".join(e.cmd),
+                                                                stderr=commands.ensure_str(e.stderr or b"").strip()))
+        except subprocess.TimeoutExpired as e:
+            record = dict(record="pair", head=head, base=base,
+                          error="Timed out after {timeout}s running: {cmd}".format(timeout=e.timeout,
+                                                                                  cmd=" ".join(e.cmd)))
+        write_ndjson(record)
+
+
+def batch_reviewers(pairs, jobs=None, timeout=None, use_cache=True, context=DEFAULT_CONTEXT):
+    """
+    Writes a pair record of suggested reviewers for each (head, base) pair, in one process.
+    The pairs are done one after the other through one blame cache, so a blame of the same
+    (merge base, path, ranges) is only run once however many pairs share it.  Without the
+    cache on disk, an in-memory one is used for the run.
+    """
+    commands.configure(jobs, timeout)
+    git_dir = run_sync(get_git_dir())
+    cache = open_cache(git_dir) if use_cache else open_memory_cache()
+    open_index(git_dir)
+    try:
+        run_sync(write_batch_records(pairs, context))
+    except subprocess.TimeoutExpired as e:
+        shl.error("\nTimed out after {timeout}s running: {cmd}\n", timeout=e.timeout, cmd=" ".join(e.cmd))
+        sys.exit(4)
+    finally:
+        cache.close()
+
+
+def get_reviewers(contributor, branch, files, output, jobs=None, timeout=None, use_cache=True, cache_stats=False,
+                  context=DEFAULT_CONTEXT, whole_file_threshold=None, profiling=False, trace=None, processes=None,
+                  score="lines", half_life=scoring.HALF_LIFE_DAYS, deadline=None, top=None, sample_size=None,
+                  seed=sampling.DEFAULT_SEED):
+    profiler = profile.enable() if profiling or trace else None
+    try:
+        run_reviewers(contributor, branch, files, output, jobs, timeout, use_cache, cache_stats, context,
+                      whole_file_threshold, processes, score, half_life, deadline, top, sample_size, seed)
+    finally:
+        if profiler:
+            print_profile(profiler, trace)
+
+
+def run_reviewers(contributor, branch, files, output, jobs=None, timeout=None, use_cache=True, cache_stats=False,
+                  context=DEFAULT_CONTEXT, whole_file_threshold=None, processes=None, score="lines",
+                  half_life=scoring.HALF_LIFE_DAYS, deadline=None, top=None, sample_size=None,
+                  seed=sampling.DEFAULT_SEED):
+    """
+    Gets and outputs the suggested reviewers.  With a deadline, in seconds from now, the
+    files are blamed most changed first until it passes, and the ranking is of those blamed.
+    With `top`, only that many reviewers are output, and blaming stops once they are settled.
+    With a sample size, the ranking is estimated from a sample of that many hunks.
+    """
+    deadline = time.monotonic() + deadline if deadline else None
+    commands.configure(jobs, timeout)
+    planner.configure(whole_file_threshold)
+    sharded = processes and processes > 1
+    git_dir = run_sync(get_git_dir())
+    cache = open_cache(git_dir) if use_cache and not sharded else None # Workers open their own
+    if not contributor:
+        open_index(git_dir) # Contributor lines need the code, which only a live blame has
+
     shl.print_section(shl.BOLD, "Diff Raw Output:")
-    diff_infos = []
-    for diff in raw:
-        diff_info = get_file_reviewers(diff, branch)
-        if not diff_info.get("type"):
-            continue
-        if files and abspath(diff_info['file']) not in files:
-            continue
-        diff_infos.append(diff_info)
-        if diff_info["type"] == "A":
-            shl.print_color(shl.GREEN, diff)
-        elif diff_info["type"] == "D":
-            shl.print_color(shl.RED, diff)
-        elif diff_info["type"] == "M":
-            shl.print_color(shl.YELLOW, diff)
-        else:
-            shl.print_color(shl.LTBLUE, diff)
+    diff_infos = [] if output == "raw" or contributor else None
+    on_diff_info = write_file_record if output == "ndjson" else print_diff_info
+    collect_columns = (score != "lines" or output == "ndjson") and not sample_size # A sample has no exact lines
+    columns = scoring.BlameColumns() if collect_columns else None
+    coverage = sample = None
+    try:
+        with profile.stage("stream"):
+            if sample_size:
+                num_files, estimates, sample = run_sync(stream_sampled_reviewers(branch, files, on_diff_info, context,
+                                                                                 sample_size, seed))
+            elif deadline or top:
+                num_files, total_reviewers, coverage = run_sync(stream_anytime_reviewers(
+                    branch, files, on_diff_info, context, columns, deadline, top))
+            elif sharded:
+                num_files, total_reviewers = shard_reviewers(branch, files, processes, on_diff_info, use_cache,
+                                                             context, whole_file_threshold, columns)
+            else:
+                num_files, total_reviewers = run_sync(stream_reviewers(branch, files, diff_infos, on_diff_info,
+                                                                       bool(contributor) or output != "default",
+                                                                       context, columns=columns))
+    except subprocess.TimeoutExpired as e:
+        shl.error("\nTimed out after {timeout}s running: {cmd}\n", timeout=e.timeout, cmd=" ".join(e.cmd))
+        sys.exit(4)
 
     shl.stderr("")
 
-    if not diff_infos:
+    if cache:
+        if cache_stats:
+            print_cache_stats(cache)
+        cache.close()
+
+    if not num_files:
         # TODO: How to suggest reviewers for only added files
         shl.print_color(shl.BOLD, "\nNo relevant file diffs found. That might be because you've only added files.\n")
         sys.exit(1)
 
+    with profile.stage("score"):
+        scores = scoring.score(columns, half_life_days=half_life) if columns is not None else None
+
     if output == "raw":
-        shl.stdout(diff_infos)
+        with profile.stage("output"):
+            shl.stdout([diff_info.to_dict() for diff_info in diff_infos])
+
+    elif output == "ndjson":
+        with profile.stage("rank"):
+            if sample:
+                ranked = rank_estimates(estimates)
+            else:
+                ranked = rank_reviewers(total_reviewers, run_sync(get_current_user()), scores and scores[score])[:top]
+        write_summary_record(num_files, ranked, score, scores, coverage, sample)
 
     elif output == "default":
         if contributor:
-            print_contributer_lines(contributor, diff_infos)
+            with profile.stage("output"):
+                print_contributer_lines(contributor, diff_infos)
         else:
-            print_suggested_reviewers(diff_infos)
+            with profile.stage("rank"):
+                if sample:
+                    ranked = rank_estimates(estimates)
+                else:
+                    ranked = rank_reviewers(total_reviewers, run_sync(get_current_user()),
+                                            scores and scores[score])[:top]
+            print_suggested_reviewers(ranked, coverage, sample)
     else:
         shl.error("Unrecognized output type: {output}", output=output)
         sys.exit(3)
@@ -0,0 +1,155 @@
+"""
+Estimating the reviewers of a giant diff, such as a formatter run, from a sample of its hunks
+rather than blaming all of them.  The hunks are stratified by directory, each directory gets a
+share of the sample in proportion to its changed lines, and within a directory hunks are drawn
+with replacement with probability in proportion to their size.  Each reviewer's lines are
+scaled back up from the share of the drawn hunks' lines that are theirs (the Hansen-Hurwitz
+estimator), with a confidence interval on their share of the diff from the spread between the
+draws.  The draws come from a seeded generator, so the same diff and seed give the same result.
+"""
+import math
+import posixpath
+import random
+
+
+DEFAULT_SEED = 0
+MIN_DRAWS = 2 # Per directory, a spread needs at least two
+Z = 1.96 # 95% confidence
+
+
+def get_directory(path, depth):
+    return "/".join(posixpath.dirname(path).split("/")[:depth])
+
+
+def get_strata(paths, max_strata):
+    """
+    Groups the indexes of the paths by directory, going up to shallower directories until
+    there are at most max_strata of them
+    """
+    depth = max(path.count("/") for path in paths) if paths else 0
+    while True:
+        strata = {}
+        for idx, path in enumerate(paths):
+            strata.setdefault(get_directory(path, depth), []).append(idx)
+        if len(strata) <= max_strata or not depth:
+            return strata
+        depth -= 1
+
+
+def share_out(keys, strata_lines, strata_hunks, size):
+    """
+    Shares out the sample size between the strata in proportion to their lines, with at least
+    MIN_DRAWS each where the size and their hunks allow, most lines first, and the rest by
+    largest remainder
+    """
+    allocation = {}
+    for key in sorted(keys, key=lambda key: -strata_lines[key]):
+        allocation[key] = min(MIN_DRAWS, strata_hunks[key], size - sum(allocation.values()))
+    remaining = size - sum(allocation.values())
+    total_lines = sum(strata_lines[key] for key in keys)
+    quotas = dict((key, remaining * strata_lines[key] / total_lines if total_lines else 0) for key in keys)
+    for key, quota in quotas.items():
+        allocation[key] += int(quota)
+
+    leftover = size - sum(allocation.values())
+    for key in sorted(quotas, key=lambda key: int(quotas[key]) - quotas[key])[:max(leftover, 0)]:
+        allocation[key] += 1
+    return allocation
+
+
+def allocate(strata_lines, strata_hunks, size):
+    """
+    Shares out the sample size between the strata, giving the strata whose share would cover
+    all of their hunks just those, and sharing the rest out again between the others
+    """
+    allocation = {}
+    keys = list(strata_lines)
+    while keys:
+        shares = share_out(keys, strata_lines, strata_hunks, size - sum(allocation.values()))
+        full = set(key for key in keys if shares[key] >= strata_hunks[key])
+        if not full:
+            allocation.update(shares)
+            break
+        for key in full:
+            allocation[key] = strata_hunks[key]
+        keys = [key for key in keys if key not in full]
+    return allocation
+
+
+class HunkSample(object):
+    """
+    A stratified sample of a diff's hunks, given as (path, lines) pairs.  `draws` has the hunk
+    indexes drawn from each directory, and `census` the directories small enough to take all
+    of their hunks, whose lines are counted rather than estimated.
+    """
+    def __init__(self, hunks, size, seed=DEFAULT_SEED):
+        self.sizes = [lines for _, lines in hunks]
+        self.size = size
+        self.seed = seed
+        rng = random.Random(seed)
+
+        strata = get_strata([path for path, _ in hunks], max(size // MIN_DRAWS, 1))
+        self.strata_lines = dict((key, sum(self.sizes[idx] for idx in indexes)) for key, indexes in strata.items())
+        allocation = allocate(self.strata_lines, dict((key, len(indexes)) for key, indexes in strata.items()), size)
+
+        self.draws = {}
+        self.census = set()
+        for key, indexes in strata.items():
+            if allocation[key] >= len(indexes):
+                self.census.add(key)
+                self.draws[key] = list(indexes)
+            else:
+                self.draws[key] = rng.choices(indexes, weights=[self.sizes[idx] for idx in indexes], k=allocation[key])
+
+    def get_sampled(self):
+        """The indexes of the hunks to blame, each once however many times it was drawn"""
+        return sorted(set(idx for draws in self.draws.values() for idx in draws))
+
+    def to_dict(self):
+        sampled = self.get_sampled()
+        return dict(hunks=len(self.sizes), sampled_hunks=len(sampled), changed_lines=sum(self.sizes),
+                    sampled_lines=sum(self.sizes[idx] for idx in sampled), strata=len(self.draws), seed=self.seed)
+
+    def estimate(self, hunk_lines, exact=None, exclude=None):
+        """
+        Estimates each reviewer's lines from the blamed lines of the sampled hunks, given as
+        {hunk index: {reviewer: lines}}, plus the `exact` lines of files that weren't sampled.
+        Returns {reviewer: (lines, share, error)}, with their share of the lines of everyone but
+        `exclude` and the half width of its confidence interval.
+        """
+        totals = dict(exact or {})
+        for key, draws in self.draws.items():
+            scale = 1 if key in self.census else self.strata_lines[key] / len(draws)
+            for idx in draws:
+                weight = scale if key in self.census else scale / self.sizes[idx]
+                for reviewer, lines in hunk_lines.get(idx, {}).items():
+                    totals[reviewer] = totals.get(reviewer, 0) + lines * weight
+
+        total = sum(lines for reviewer, lines in totals.items() if reviewer != exclude)
+        if not total:
+            return {}
+
+        # The share's variance by linearization: each draw's share of the reviewer's lines less
+        # their overall share of the draw's lines of everyone included
+        ratios = {}
+        for key, draws in self.draws.items():
+            if key in self.census or len(draws) < 2:
+                continue
+            ratios[key] = [(hunk_lines.get(idx, {}),
+                            sum(lines for reviewer, lines in hunk_lines.get(idx, {}).items() if reviewer != exclude),
+                            self.sizes[idx]) for idx in draws]
+
+        estimates = {}
+        for reviewer, lines in totals.items():
+            if reviewer == exclude:
+                continue
+            share = lines / total
+            variance = 0
+            for key, draws in ratios.items():
+                values = [(counts.get(reviewer, 0) - share * included) / size for counts, included, size in draws]
+                mean = sum(values) / len(values)
+                spread = sum((value - mean) ** 2 for value in values) / (len(values) - 1)
+                variance += self.strata_lines[key] ** 2 * spread / len(values)
+            estimates[reviewer] = (lines, share, Z * math.sqrt(variance) / total)
+
+        return estimates
@@ -0,0 +1,212 @@
+"""
+A long running reviewer server for `git reviewers serve`.  It answers queries for one
+repository over HTTP, on a Unix socket or a localhost port, keeping everything a single run
+has to set up warm between queries: the modules, the blame cache and ownership index, a
+long running `git cat-file` to resolve refs, and the answers to recent queries.
+
+    GET /reviewers?head=feature&base=master&path=src/&context=3
+    POST /reviewers {"head": "feature", "base": "master", "paths": ["src/"], "context": 3}
+    GET /health
+
+The answers are the `pair` records of `git reviewers batch`, with `cached` set when the
+answer was reused because neither ref has moved since.
+"""
+import asyncio
+from collections import OrderedDict
+import json
+import os
+import signal
+import subprocess
+from urllib.parse import parse_qs, urlsplit
+
+from git_reviewers import commands
+from git_reviewers.cache import CACHE_DIR, open_cache, open_memory_cache
+from git_reviewers.commands import run_sync
+from git_reviewers.index import open_index
+from git_reviewers.reviewers import (DEFAULT_CONTEXT, get_commit, get_current_user, get_git_dir, get_pair_reviewers,
+                                     get_toplevel)
+import python_lib.shell as shl
+
+
+MAX_ANSWERS = 1024
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error",
+           504: "Gateway Timeout"}
+
+
+class QueryError(ValueError):
+    pass
+
+
+class ReviewerServer(object):
+    def __init__(self, default_base, max_answers=MAX_ANSWERS):
+        self.default_base = default_base
+        self.max_answers = max_answers
+        self.answers = OrderedDict()
+        self.current_user = None
+        self.toplevel = None
+
+    async def start(self):
+        commands.set_cat_file(commands.CatFile())
+        self.current_user = await get_current_user()
+        self.toplevel = await get_toplevel()
+
+    async def close(self):
+        await commands.get_cat_file().close()
+        commands.set_cat_file(None)
+
+    def get_query(self, method, target, body):
+        url = urlsplit(target)
+        if method == "GET":
+            params = parse_qs(url.query)
+            query = dict(head=params.get("head", [None])[0], base=params.get("base", [None])[0],
+                         paths=params.get("path", []), context=params.get("context", [DEFAULT_CONTEXT])[0])
+        elif method == "POST":
+            try:
+                query = json.loads(body or b"{}")
+            except ValueError:
+                raise QueryError("The body isn't JSON")
+            if not isinstance(query, dict):
+                raise QueryError("The body isn't a JSON object")
+        else:
+            raise QueryError("Only GET and POST are supported")
+
+        if not query.get("head"):
+            raise QueryError("A head ref is needed")
+        try:
+            context = int(query.get("context", DEFAULT_CONTEXT))
+        except (TypeError, ValueError):
+            raise QueryError("The context isn't a number")
+        if context < 0:
+            raise QueryError("The context can't be negative")
+        paths = query.get("paths") or []
+        if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+            raise QueryError("The paths aren't a list of strings")
+
+        return query["head"], query.get("base") or self.default_base, tuple(paths), context
+
+    async def get_reviewers(self, head, base, paths, context):
+        """The pair record of the query, reused while the refs point at the same commits"""
+        key = (await get_commit(head), await get_commit(base), paths, context)
+        answer = self.answers.get(key)
+        if answer:
+            self.answers.move_to_end(key)
+            return dict(answer, head=head, base=base, cached=True)
+
+        answer = await get_pair_reviewers(key[0], key[1], self.current_user, context, list(paths) or None)
+        self.answers[key] = answer
+        if len(self.answers) > self.max_answers:
+            self.answers.popitem(last=False)
+        return dict(answer, head=head, base=base, cached=False)
+
+    async def answer(self, method, target, body):
+        path = urlsplit(target).path
+        if path == "/health":
+            return 200, dict(status="ok", repo=self.toplevel, answers=len(self.answers))
+        if path != "/reviewers":
+            return 404, dict(error="Unknown path {path}".format(path=path))
+
+        try:
+            return 200, await self.get_reviewers(*self.get_query(method, target, body))
+        except QueryError as e:
+            return 405 if method not in ("GET", "POST") else 400, dict(error=str(e))
+        except subprocess.CalledProcessError as e:
+            return 400, dict(error="{cmd} failed: {stderr}".format(
+                cmd=" ".join(e.cmd), stderr=commands.ensure_str(e.stderr or b"").strip()))
+        except subprocess.TimeoutExpired as e:
+            return 504, dict(error="Timed out after {timeout}s running: {cmd}".format(timeout=e.timeout,
+                                                                                      cmd=" ".join(e.cmd)))
+
+    async def handle(self, reader, writer):
+        """Answers the requests of a connection until the client closes it or asks to"""
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+
+                method, target, headers, body = request
+                try:
+                    status, response = await self.answer(method, target, body)
+                except Exception as e:
+                    shl.exception("Failed to answer {method} {target}", method=method, target=target)
+                    status, response = 500, dict(error=str(e))
+
+                write_response(writer, status, response)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+async def read_request(reader):
+    """Reads an HTTP request as (method, target, headers, body), None once the connection closes"""
+    line = await reader.readline()
+    if not line.strip():
+        return None
+
+    method, target, _ = line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        key, _, value = line.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return method, target, headers, body
+
+
+def write_response(writer, status, response):
+    body = json.dumps(response, cls=shl.JSONEncoder).encode("utf-8")
+    writer.write("HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\nContent-Length: {length}\r\n\r\n"
+                 .format(status=status, reason=REASONS.get(status, ""), length=len(body)).encode("latin-1") + body)
+
+
+async def serve(default_base, socket_path=None, port=None):
+    reviewer_server = ReviewerServer(default_base)
+    await reviewer_server.start()
+    if socket_path:
+        server = await asyncio.start_unix_server(reviewer_server.handle, socket_path)
+        address = socket_path
+    else:
+        server = await asyncio.start_server(reviewer_server.handle, "127.0.0.1", port)
+        address = "http://127.0.0.1:{port}".format(port=server.sockets[0].getsockname()[1])
+
+    shl.info("Serving reviewers for {repo} on {address}", repo=reviewer_server.toplevel, address=address)
+    serving = asyncio.ensure_future(server.serve_forever())
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(signum, serving.cancel)
+    try:
+        async with server:
+            await serving
+    except asyncio.CancelledError:
+        shl.info("Stopped serving")
+    finally:
+        await reviewer_server.close()
+
+
+def get_socket_path(git_dir):
+    return os.path.join(git_dir, CACHE_DIR, "server.sock")
+
+
+def run_server(default_base, socket_path=None, port=None, jobs=None, timeout=None, use_cache=True):
+    """Serves the repository in the working directory on the Unix socket, or on the port when given"""
+    commands.configure(jobs, timeout)
+    git_dir = run_sync(get_git_dir())
+    cache = open_cache(git_dir) if use_cache else open_memory_cache()
+    open_index(git_dir)
+    if not socket_path and port is None:
+        socket_path = get_socket_path(git_dir)
+
+    if socket_path and os.path.exists(socket_path):
+        os.remove(socket_path) # Left behind by a server that didn't shut down cleanly
+    try:
+        run_sync(serve(default_base, socket_path, port))
+    finally:
+        cache.close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
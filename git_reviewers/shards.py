@@ -0,0 +1,58 @@
+"""
+Splits the changed files of a big diff into shards for worker processes, keeping each directory
+together where it can, and merges the reviewer line tallies the workers send back.
+"""
+import heapq
+import posixpath
+
+from git_reviewers import planner
+
+
+def get_weight(diff_info):
+    """Roughly how much work blaming the file is, the same estimate the blame planner uses"""
+    return planner.get_ranges_cost(diff_info.chunks)
+
+
+def group_by_directory(diff_infos):
+    groups = {}
+    for diff_info in diff_infos:
+        groups.setdefault(posixpath.dirname(diff_info.file), []).append(diff_info)
+    return list(groups.values())
+
+
+def shard_diff_infos(diff_infos, num_shards):
+    """
+    Splits the diff infos into at most num_shards lists of about the same weight.  Directories
+    are kept whole unless one alone would outweigh a shard, and the heaviest pieces are placed
+    first, each on the lightest shard so far.
+    """
+    target = sum(get_weight(diff_info) for diff_info in diff_infos) / num_shards
+
+    pieces = []
+    for group in group_by_directory(diff_infos):
+        piece, weight = [], 0
+        for diff_info in group:
+            if piece and weight + get_weight(diff_info) > target:
+                pieces.append((weight, piece))
+                piece, weight = [], 0
+            piece.append(diff_info)
+            weight += get_weight(diff_info)
+        pieces.append((weight, piece))
+
+    shards = [(0, idx, []) for idx in range(num_shards)]
+    for weight, piece in sorted(pieces, key=lambda piece: -piece[0]):
+        shard_weight, idx, shard = heapq.heappop(shards)
+        shard += piece
+        heapq.heappush(shards, (shard_weight + weight, idx, shard))
+
+    return [shard for _, _, shard in sorted(shards, key=lambda shard: shard[1]) if shard]
+
+
+def merge_tallies(tallies):
+    """Adds up the reviewer line tallies of the shards into the totals of the whole diff"""
+    total_reviewers = {}
+    for tally in tallies:
+        for reviewer, lines in tally.items():
+            total_reviewers[reviewer] = total_reviewers.get(reviewer, 0) + lines
+
+    return total_reviewers
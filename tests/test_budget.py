@@ -0,0 +1,32 @@
+import asyncio
+
+from git_reviewers import budget, reviewers
+
+
+def test_coverage_partial_with_skipped_files():
+    coverage = budget.Coverage()
+    assert not coverage.partial
+
+    coverage.add_skipped(0) # A file whose hunks were never read
+    assert coverage.partial and coverage.ratio == 1.0
+
+
+def test_blame_in_order_skips_files_past_the_deadline(monkeypatch):
+    async def get_file_reviewers(diff_info, branch, keep_code=True, store=True, deadline=None):
+        if diff_info == "late":
+            raise budget.DeadlineExceeded()
+        return diff_info
+
+    monkeypatch.setattr(reviewers, "get_file_reviewers", get_file_reviewers)
+    blamed = []
+    skipped = asyncio.run(reviewers.blame_in_order("HEAD", ["a", "late", "b"], blamed.append))
+
+    assert sorted(blamed) == ["a", "b"]
+    assert skipped == ["late"]
+
+
+def test_is_top_settled():
+    assert budget.is_top_settled([10, 2], 1, 7)
+    assert not budget.is_top_settled([10, 2], 1, 8)
+    assert not budget.is_top_settled([10], 2, 1)
+    assert budget.is_top_settled([], 3, 0)
@@ -0,0 +1,39 @@
+from git_reviewers.cache import BlameCache
+
+
+def test_evicts_least_recently_used(monkeypatch):
+    now = [0]
+    monkeypatch.setattr("git_reviewers.cache.time.time", lambda: now[0])
+    cache = BlameCache(":memory:", max_size=10)
+
+    for idx, path in enumerate(("a", "b", "c")):
+        now[0] = idx
+        cache.put_blame("sha", path, "1,1", ["xxx"])
+    now[0] = 3
+    assert cache.get_blame("sha", "a", "1,1") == ["xxx"] # Now b is the least recently used
+    assert cache.total_size == cache.size() == 9
+
+    now[0] = 4
+    cache.put_result("sha", "from", "to", "d", 3, [1]) # Three more bytes
+    assert cache.get_blame("sha", "b", "1,1") is None
+    assert cache.get_blame("sha", "a", "1,1") == ["xxx"]
+    assert cache.evictions == 1
+    assert cache.total_size == cache.size() == 9
+
+
+def test_replacing_an_entry_counts_its_size_once():
+    cache = BlameCache(":memory:", max_size=10)
+    cache.put_blame("sha", "a", "1,1", ["xxxxxx"])
+    cache.put_blame("sha", "a", "1,1", ["xxxxxxxx"])
+
+    assert cache.evictions == 0
+    assert cache.total_size == cache.size() == 8
+
+
+def test_size_is_read_on_open(tmp_path):
+    path = str(tmp_path / "blame.sqlite")
+    cache = BlameCache(path)
+    cache.put_blame("sha", "a", "1,1", ["xxx", "yy"])
+    cache.close()
+
+    assert BlameCache(path).total_size == 6
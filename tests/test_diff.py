@@ -0,0 +1,150 @@
+from git_reviewers.records import Hunk
+from git_reviewers.reviewers import merge_hunks, read_blame_porcelain, read_diff
+
+
+DIFF = """\
+:100644 120000 01e79c3 63d8dbd T\ta
+:100644 100644 e8823e1 8d3ec85 M\tb
+:100644 100644 e8823e1 e63784c M\tc
+:100644 100644 c600332 63600f5 M\t"d\\303\\251j\\303\\240"
+:100644 100755 975fbec 975fbec M\tm
+:100644 100644 587be6b 7a2c1f0 R090\tsp ace\tsp ace2
+
+diff --git a/a b/a
+deleted file mode 100644
+index 01e79c3..0000000
+--- a/a
++++ /dev/null
+@@ -1,3 +0,0 @@
+-1
+-2
+-3
+diff --git a/a b/a
+new file mode 120000
+index 0000000..63d8dbd
+--- /dev/null
++++ b/a
+@@ -0,0 +1 @@
++b
+\\ No newline at end of file
+diff --git a/b b/b
+index e8823e1..8d3ec85 100644
+--- a/b
++++ b/b
+@@ -12,7 +12,7 @@
+ 12
+-15
++X
+diff --git a/c b/c
+index e8823e1..e63784c 100644
+--- a/c
++++ b/c
+@@ -17,7 +17,7 @@
+ 17
+-20
++Y
+@@ -40 +40,2 @@
+ 40
++41
+diff --git "a/d\\303\\251j\\303\\240" "b/d\\303\\251j\\303\\240"
+index c600332..63600f5 100644
+--- "a/d\\303\\251j\\303\\240"
++++ "b/d\\303\\251j\\303\\240"
+@@ -1 +1,2 @@
+ x
++y
+diff --git a/m b/m
+old mode 100644
+new mode 100755
+diff --git a/sp ace b/sp ace2
+similarity index 90%
+rename from sp ace
+rename to sp ace2
+index 587be6b..7a2c1f0 100644
+--- a/sp ace
++++ b/sp ace2
+@@ -5,3 +5,4 @@
+ 5
++6
+"""
+
+
+def get_chunks(diff_infos):
+    return dict((diff_info.paths, [(chunk.start_line, chunk.num_lines) for chunk in diff_info.chunks])
+                for diff_info in diff_infos)
+
+
+def test_read_diff_matches_patches_by_path():
+    diff_infos = read_diff(DIFF.split("\n"))
+
+    assert [diff_info.type for diff_info in diff_infos] == ["T", "M", "M", "M", "M", "R"]
+    assert get_chunks(diff_infos) == {
+        ("a",): [(1, 3)], # Only the deletion half of the typechange
+        ("b",): [(12, 7)],
+        ("c",): [(17, 7), (40, 1)],
+        ("déjà",): [(1, 1)], # Unquoted
+        ("m",): [], # Mode only
+        ("sp ace", "sp ace2"): [(5, 3)],
+    }
+
+
+def test_read_diff_without_a_patch():
+    lines = DIFF.split("\n")
+    unmerged = ":000000 000000 0000000 0000000 U\tu"
+    diff_infos = read_diff([unmerged] + lines)
+
+    assert get_chunks(diff_infos)[("u",)] == []
+    assert get_chunks(diff_infos)[("b",)] == [(12, 7)]
+
+
+def test_read_diff_raw_only():
+    diff_infos = read_diff([line for line in DIFF.split("\n") if line.startswith(":")], patch=False)
+
+    assert [diff_info.paths for diff_info in diff_infos][-1] == ("sp ace", "sp ace2")
+    assert all(not diff_info.chunks for diff_info in diff_infos)
+
+
+BLAME = """\
+ca4700d6eebc5eedb928cfc24d0df97450069218 12 12 2
+author Alice Smith
+author-mail <a@x>
+author-time 1700000000
+author-tz +0000
+summary i
+filename b
+\t12
+ca4700d6eebc5eedb928cfc24d0df97450069218 13 13
+\t13
+e8823e1aa8d3ec85e63784cc600332563600f5aa 14 14 1
+author Bob
+author-mail <b@x>
+author-time 1700000100
+author-tz +0000
+summary j
+filename b
+\t
+"""
+
+
+def test_read_blame_porcelain():
+    commits = {}
+    records = read_blame_porcelain(BLAME.split("\n"), commits)
+
+    assert records == [(12, "ca4700d6eebc5eedb928cfc24d0df97450069218", "12"),
+                       (13, "ca4700d6eebc5eedb928cfc24d0df97450069218", "13"),
+                       (14, "e8823e1aa8d3ec85e63784cc600332563600f5aa", "")]
+    assert commits["ca4700d6eebc5eedb928cfc24d0df97450069218"] == dict(
+        sha="ca4700d6eebc5eedb928cfc24d0df97450069218", author="Alice Smith", email="a@x", time=1700000000)
+    assert commits["e8823e1aa8d3ec85e63784cc600332563600f5aa"]["author"] == "Bob"
+
+
+def test_read_blame_porcelain_stripped_empty_line():
+    lines = ["ca4700d6eebc5eedb928cfc24d0df97450069218 7 7 1", "author Alice Smith", "author-mail <a@x>",
+             "author-time 1", "filename b"] # git output stripped of its trailing tab line
+    assert read_blame_porcelain(lines, {}) == [(7, "ca4700d6eebc5eedb928cfc24d0df97450069218", "")]
+
+
+def test_merge_hunks():
+    merged = merge_hunks([Hunk(20, 5), Hunk(1, 3), Hunk(3, 4), Hunk(7, 2), Hunk(30, 0), Hunk(0, 0)])
+
+    assert [(hunk.start_line, hunk.num_lines) for hunk in merged] == [(1, 8), (20, 5), (30, 1)]
@@ -0,0 +1,30 @@
+import subprocess
+
+from git_reviewers.commands import run_sync
+from git_reviewers.index import build_index
+from git_reviewers.records import Hunk
+
+
+def git(*args):
+    return subprocess.run(["git"] + list(args), check=True, capture_output=True, text=True).stdout.strip()
+
+
+def test_build_index_skips_submodules(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    git("init", "-q")
+    git("config", "user.name", "Alice")
+    git("config", "user.email", "alice@example.com")
+    (tmp_path / "a.txt").write_text("1\n2\n")
+    git("add", "a.txt")
+    git("commit", "-q", "-m", "Add")
+    git("update-index", "--add", "--cacheinfo", "160000," + git("rev-parse", "HEAD") + ",sub") # A gitlink
+    git("commit", "-q", "-m", "Add a submodule")
+    commit_sha = git("rev-parse", "HEAD")
+
+    index = run_sync(build_index(str(tmp_path / ".git"), commit_sha, str(tmp_path)))
+    run_sync(index.prepare(commit_sha))
+    commits = {}
+    assert [line_num for line_num, _, _ in index.query(commit_sha, "a.txt", [Hunk(1, 2)], commits)] == [1, 2]
+    assert commits[git("rev-parse", "HEAD~")]["author"] == "Alice"
+    assert index.query(commit_sha, "sub", [Hunk(1, 1)], {}) is None
+    index.close()
@@ -0,0 +1,62 @@
+import json
+import subprocess
+
+import pytest
+
+from git_reviewers import cache, reviewers
+from git_reviewers.authors import get_authors
+from git_reviewers.commands import run_sync
+from git_reviewers.reviewers import get_diff_infos
+
+
+def git(*args, **kwargs):
+    subprocess.run(["git"] + list(args), check=True, capture_output=True, **kwargs)
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    """A repository with a commit of a file whose name git quotes, changed in the work tree"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(cache, "CACHE", None)
+    git("init", "-q", "-b", "master")
+    git("config", "user.name", "Alice")
+    git("config", "user.email", "alice@example.com")
+    (tmp_path / "déjà.txt").write_text("1\n2\n3\n")
+    git("add", "-A")
+    git("commit", "-q", "-m", "Add")
+    (tmp_path / "déjà.txt").write_text("1\nX\n3\n")
+    return tmp_path
+
+
+def get_lines(diff_infos):
+    return dict((diff_info.file, dict((get_authors().get_name(reviewer), len(lines))
+                                      for reviewer, lines in diff_info.reviewers.items()))
+                for diff_info in diff_infos)
+
+
+def test_blames_a_quoted_path(repo):
+    assert get_lines(run_sync(get_diff_infos("master"))) == {"déjà.txt": {"Alice": 3}}
+
+
+def test_blames_a_quoted_path_with_the_cache(repo):
+    cache.open_memory_cache()
+    assert get_lines(run_sync(get_diff_infos("master"))) == {"déjà.txt": {"Alice": 3}}
+    assert get_lines(run_sync(get_diff_infos("master"))) == {"déjà.txt": {"Alice": 3}} # Restored
+
+
+def test_batch_writes_an_error_record_for_a_pair_that_times_out(monkeypatch, capsys):
+    async def get_pair_reviewers(head, base, current_user=None, context=3):
+        if head == "slow":
+            raise subprocess.TimeoutExpired(["git", "blame"], 5)
+        return dict(record="pair", head=head, base=base)
+
+    async def get_current_user():
+        return None
+
+    monkeypatch.setattr(reviewers, "get_pair_reviewers", get_pair_reviewers)
+    monkeypatch.setattr(reviewers, "get_current_user", get_current_user)
+    run_sync(reviewers.write_batch_records([("slow", "master"), ("fast", "master")]))
+
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert records == [dict(record="pair", head="slow", base="master", error="Timed out after 5s running: git blame"),
+                       dict(record="pair", head="fast", base="master")]
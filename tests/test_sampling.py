@@ -0,0 +1,61 @@
+import random
+
+from git_reviewers import sampling
+
+
+def get_population(num_files=60, seed=1):
+    """(path, lines) hunks and each hunk's {reviewer: lines}, across a few directories"""
+    rng = random.Random(seed)
+    hunks, hunk_lines = [], {}
+    for idx in range(num_files * 3):
+        directory = "dir{num}".format(num=idx % 5)
+        lines = rng.randint(1, 30)
+        owner = "owner{num}".format(num=idx % 5)
+        other = min(rng.randint(0, lines), lines // 3)
+        hunks.append(("{directory}/file{num}.py".format(directory=directory, num=idx // 3), lines))
+        hunk_lines[idx] = dict((reviewer, count) for reviewer, count in ((owner, lines - other), ("other", other))
+                               if count)
+    return hunks, hunk_lines
+
+
+def get_shares(hunk_lines):
+    totals = {}
+    for counts in hunk_lines.values():
+        for reviewer, lines in counts.items():
+            totals[reviewer] = totals.get(reviewer, 0) + lines
+    total = sum(totals.values())
+    return dict((reviewer, (lines, lines / total)) for reviewer, lines in totals.items())
+
+
+def test_census_is_exact():
+    hunks, hunk_lines = get_population()
+    sample = sampling.HunkSample(hunks, len(hunks), seed=7)
+
+    assert sample.get_sampled() == list(range(len(hunks)))
+    estimates = sample.estimate(hunk_lines)
+    assert dict((reviewer, (lines, share)) for reviewer, (lines, share, _) in estimates.items()) == \
+        get_shares(hunk_lines)
+    assert all(error == 0 for _, _, error in estimates.values())
+
+
+def test_same_seed_same_sample():
+    hunks, _ = get_population()
+    assert sampling.HunkSample(hunks, 40, seed=3).draws == sampling.HunkSample(hunks, 40, seed=3).draws
+
+
+def test_interval_coverage():
+    """About 95% of the intervals should hold the true share, less with a handful of draws per directory"""
+    hunks, hunk_lines = get_population()
+    shares = get_shares(hunk_lines)
+    covered = total = 0
+    for seed in range(200):
+        for reviewer, (lines, share, error) in sampling.HunkSample(hunks, 120, seed).estimate(hunk_lines).items():
+            total += 1
+            covered += abs(share - shares[reviewer][1]) <= error
+    assert covered / total >= 0.85
+
+
+def test_allocation_is_clamped_to_the_size():
+    hunks, _ = get_population()
+    assert len(sampling.HunkSample(hunks, 1).get_sampled()) == 1
+    assert sum(sampling.allocate(dict(a=10, b=5), dict(a=4, b=4), 3).values()) == 3
@@ -0,0 +1,19 @@
+import json
+
+import pytest
+
+from git_reviewers.server import QueryError, ReviewerServer
+
+
+def test_get_query():
+    server = ReviewerServer("master")
+    assert server.get_query("GET", "/reviewers?head=feature&context=5&path=a&path=b", b"") == \
+        ("feature", "master", ("a", "b"), 5)
+    assert server.get_query("POST", "/reviewers", json.dumps(dict(head="feature", base="main")).encode()) == \
+        ("feature", "main", (), 3)
+
+
+@pytest.mark.parametrize("query", ["head=feature&context=-2", "head=feature&context=x", "context=1"])
+def test_get_query_rejects(query):
+    with pytest.raises(QueryError):
+        ReviewerServer("master").get_query("GET", "/reviewers?" + query, b"")